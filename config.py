@@ -3,22 +3,92 @@ Configuration management for WireBot
 """
 import os
 import json
+import asyncio
+import atexit
+import bisect
+import threading
 import logging
-from typing import Dict, List, Optional
+from contextlib import contextmanager
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
 from pathlib import Path
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:  # Fall back to stdlib json
+    orjson = None
+
 # Load environment variables from .env file
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Parsed dot-notation keys, e.g. 'limits.max_clients' -> ('limits', 'max_clients')
+_PATH_CACHE: Dict[str, Tuple[str, ...]] = {}
+
+# Sentinel for single-probe dict lookups
+_MISSING = object()
+
+# Seconds to coalesce deferred writes, see _schedule_flush()
+FLUSH_DELAY = 0.25
+
+def _dump_json(data: Dict) -> bytes:
+    """Serialize config data to indented JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, indent=2).encode()
+
+def _load_json(raw: bytes) -> Dict:
+    """Parse JSON bytes into config data"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+def _split_key(key: str) -> Tuple[str, ...]:
+    """Split a dot-notation key, caching the result per unique key"""
+    path = _PATH_CACHE.get(key)
+    if path is None:
+        path = tuple(key.split('.'))
+        _PATH_CACHE[key] = path
+    return path
+
 class Config:
     """Configuration manager for WireBot"""
     
+    # Owner has no limits; shared read-only instance
+    _OWNER_LIMITS = MappingProxyType({
+        'max_clients': -1,  # -1 means unlimited
+        'rate_limit': -1,
+        'can_backup': True,
+        'can_view_stats': True,
+        'can_manage_clients': True
+    })
+    
     def __init__(self, config_file: str = "wirebot_config.json"):
         self.config_file = Path(config_file)
+        # Save batching state, see _batched_save()
+        self._suspend_save = 0
+        self._dirty = False
+        self._flush_handle = None
+        self._flush_task = None
+        # Serializes file writes between the loop thread and aflush() workers
+        self._write_lock = threading.Lock()
+        # Snapshot sequence numbers: last dumped and last written, see _write_file()
+        self._dump_seq = 0
+        self._written_seq = 0
+        # Built lazily from limits.*, reset whenever those change
+        self._default_limits = None
         self.config = self._load_config()
+        # Values fixed for the process lifetime, bound once
+        self.owner_id = self.config['owner_id']
+        self.bot_token = self.config['bot_token']
+        # Hot-path lookup for per-update authorization checks
+        self._authorized_set = set(self.config['authorized_users'])
+        # Sorted user ids for cursor paging, keyed by exclude_owner; built lazily
+        self._sorted_ids: Dict[bool, List[int]] = {}
+        # Deferred writes must not be lost on shutdown
+        atexit.register(self.flush)
     
     def _load_config(self) -> Dict:
         """Load configuration from file or create default"""
@@ -76,20 +146,20 @@ class Config:
         # Load additional config from file if it exists (for user limits, usernames, etc.)
         if self.config_file.exists():
             try:
-                with open(self.config_file, 'r') as f:
-                    loaded_config = json.load(f)
-                
-                # Merge file config with environment-based config
-                # Environment variables take precedence for sensitive data
-                merged_config = {**loaded_config, **default_config}
-                
-                # Preserve user-specific data from file
-                if 'user_limits' in loaded_config:
-                    merged_config['user_limits'] = loaded_config['user_limits']
-                if 'user_usernames' in loaded_config:
-                    merged_config['user_usernames'] = loaded_config['user_usernames']
+                loaded_config = _load_json(self.config_file.read_bytes())
                 
-                return merged_config
+                # Environment variables are authoritative for everything except
+                # the user-specific data kept in the file. JSON only allows
+                # string keys, so convert user IDs back to int once here
+                user_limits = {
+                    int(uid): limits for uid, limits in loaded_config.get('user_limits', {}).items()
+                }
+                user_usernames = {
+                    int(uid): name for uid, name in loaded_config.get('user_usernames', {}).items()
+                }
+                default_config['user_limits'] = user_limits
+                default_config['user_usernames'] = user_usernames
+                return default_config
             except Exception as e:
                 logger.error(f"Error loading config file: {e}")
                 logger.info("Using environment-based configuration")
@@ -100,54 +170,144 @@ class Config:
             return default_config
     
     def save_config(self, config: Optional[Dict] = None) -> None:
-        """Save configuration to file"""
+        """Save configuration to file atomically"""
         config_to_save = config or self.config
         try:
-            with open(self.config_file, 'w') as f:
-                json.dump(config_to_save, f, indent=2)
+            self._write_file(*self._snapshot(config_to_save))
+        except Exception as e:
+            logger.error(f"Error saving config: {e}")
+    
+    def _snapshot(self, data: Dict) -> Tuple[int, bytes]:
+        """
+        Serialize data for _write_file, stamped with the next sequence number
+        Returns: (seq, json_bytes)
+        """
+        self._dump_seq += 1
+        return self._dump_seq, _dump_json(data)
+    
+    def _write_file(self, seq: int, data: bytes) -> None:
+        """
+        Replace the config file with data atomically
+        Writes older than the last committed snapshot are dropped, so a
+        slow aflush() worker never overwrites a newer save
+        """
+        tmp_path = self.config_file.with_suffix('.json.tmp')
+        with self._write_lock:
+            if seq < self._written_seq:
+                return
+            self._written_seq = seq
+            # Write a sibling temp file and rename it over the original so a
+            # crash mid-write never leaves a truncated config behind
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.config_file)
+    
+    @contextmanager
+    def _batched_save(self):
+        """Defer saves inside the block to a single write on exit"""
+        self._suspend_save += 1
+        try:
+            yield
+        finally:
+            self._suspend_save -= 1
+            if not self._suspend_save and self._dirty:
+                self._schedule_flush()
+    
+    def _schedule_flush(self) -> None:
+        """Mark config dirty and save it after FLUSH_DELAY, coalescing rapid edits"""
+        self._dirty = True
+        if self._suspend_save or self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (CLI/setup code), write immediately
+            self.flush()
+            return
+        self._flush_handle = loop.call_later(FLUSH_DELAY, self._start_flush)
+    
+    def _start_flush(self) -> None:
+        """Timer callback: run the deferred save without blocking the loop"""
+        self._flush_handle = None
+        self._flush_task = asyncio.get_running_loop().create_task(self.aflush())
+    
+    def flush(self) -> None:
+        """Write any deferred changes to disk now"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._dirty:
+            self._dirty = False
+            self.save_config()
+    
+    async def aflush(self) -> None:
+        """Write any deferred changes to disk now, off the event loop"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._dirty:
+            return
+        self._dirty = False
+        # Serialize on the loop so handlers can't mutate the data mid-dump
+        seq, data = self._snapshot(self.config)
+        try:
+            await asyncio.to_thread(self._write_file, seq, data)
         except Exception as e:
             logger.error(f"Error saving config: {e}")
     
     def get(self, key: str, default=None):
         """Get configuration value with dot notation support"""
-        keys = key.split('.')
         value = self.config
-        for k in keys:
-            if isinstance(value, dict) and k in value:
-                value = value[k]
-            else:
+        for k in _split_key(key):
+            if not isinstance(value, dict):
+                return default
+            value = value.get(k, _MISSING)
+            if value is _MISSING:
                 return default
         return value
     
     def set(self, key: str, value) -> None:
         """Set configuration value with dot notation support"""
-        keys = key.split('.')
+        keys = _split_key(key)
         config = self.config
         for k in keys[:-1]:
             if k not in config:
                 config[k] = {}
             config = config[k]
+        # Skip the write when nothing changed. A stored list/dict passed back
+        # as-is may have been mutated in place by the caller, so always save it
+        current = config.get(keys[-1], _MISSING)
+        if current == value and not (current is value and isinstance(value, (dict, list))):
+            return
         config[keys[-1]] = value
-        self.save_config()
+        if keys[0] == 'limits':
+            self._default_limits = None
+        self._schedule_flush()
     
     def is_authorized(self, user_id: int) -> bool:
         """Check if user is authorized"""
-        return user_id in self.get('authorized_users', [])
+        # Most traffic comes from the owner, so check that first
+        return user_id == self.owner_id or user_id in self._authorized_set
     
     def is_owner(self, user_id: int) -> bool:
         """Check if user is the owner"""
-        return user_id == self.get('owner_id')
+        return user_id == self.owner_id
     
     def add_authorized_user(self, user_id: int, username: str = None) -> bool:
         """Add user to authorized list"""
-        authorized = self.get('authorized_users', [])
-        if user_id not in authorized:
-            authorized.append(user_id)
-            self.set('authorized_users', authorized)
-            
-            # Store username if provided
-            if username:
-                self.set_user_username(user_id, username)
+        if user_id not in self._authorized_set:
+            with self._batched_save():
+                authorized = self.get('authorized_users', [])
+                authorized.append(user_id)
+                self._authorized_set.add(user_id)
+                self._sorted_ids.clear()
+                self.set('authorized_users', authorized)
+                
+                # Store username if provided
+                if username:
+                    self.set_user_username(user_id, username)
             
             return True
         return False
@@ -155,78 +315,170 @@ class Config:
     def set_user_username(self, user_id: int, username: str) -> None:
         """Store username for a user ID"""
         usernames = self.get('user_usernames', {})
-        usernames[str(user_id)] = username
+        usernames[user_id] = username
         self.set('user_usernames', usernames)
     
     def get_user_username(self, user_id: int) -> Optional[str]:
         """Get stored username for a user ID"""
         usernames = self.get('user_usernames', {})
-        return usernames.get(str(user_id))
+        return usernames.get(user_id)
+    
+    def get_usernames_bulk(self, user_ids: Iterable[int]) -> Dict[int, Optional[str]]:
+        """Get stored usernames for several user IDs in one pass"""
+        usernames = self.get('user_usernames', {})
+        return {user_id: usernames.get(user_id) for user_id in user_ids}
     
     def remove_authorized_user(self, user_id: int) -> bool:
         """Remove user from authorized list"""
-        authorized = self.get('authorized_users', [])
-        if user_id in authorized and user_id != self.get('owner_id'):
-            authorized.remove(user_id)
-            self.set('authorized_users', authorized)
-            # Also remove user limits if they exist
-            self.remove_user_limits(user_id)
+        if user_id in self._authorized_set and user_id != self.owner_id:
+            with self._batched_save():
+                authorized = self.get('authorized_users', [])
+                authorized.remove(user_id)
+                self._authorized_set.discard(user_id)
+                self._sorted_ids.clear()
+                self.set('authorized_users', authorized)
+                # Also remove user limits if they exist
+                self.remove_user_limits(user_id)
             return True
         return False
     
-    def get_user_limits(self, user_id: int) -> Dict:
-        """Get limits for a specific user"""
-        user_limits = self.get('user_limits', {})
-        default_limits = {
-            'max_clients': self.get('limits.max_clients', 100),
-            'rate_limit': self.get('limits.rate_limit', 10),
-            'can_backup': True,
-            'can_view_stats': True,
-            'can_manage_clients': True
-        }
-        
-        # Owner has no limits
-        if self.is_owner(user_id):
-            return {
-                'max_clients': -1,  # -1 means unlimited
-                'rate_limit': -1,
+    def get_default_limits(self) -> Mapping:
+        """Get the limits applied to users without custom limits"""
+        if self._default_limits is None:
+            self._default_limits = MappingProxyType({
+                'max_clients': self.get('limits.max_clients', 100),
+                'rate_limit': self.get('limits.rate_limit', 10),
                 'can_backup': True,
                 'can_view_stats': True,
                 'can_manage_clients': True
-            }
+            })
+        return self._default_limits
+    
+    def get_user_limits(self, user_id: int) -> Mapping:
+        """
+        Get limits for a specific user
+        Shared defaults are read-only; copy with dict() before modifying
+        """
+        if self.is_owner(user_id):
+            return self._OWNER_LIMITS
         
-        return user_limits.get(str(user_id), default_limits)
+        return self.get('user_limits', {}).get(user_id, self.get_default_limits())
     
     def set_user_limits(self, user_id: int, limits: Dict) -> None:
         """Set limits for a specific user"""
         if self.is_owner(user_id):
             return  # Cannot set limits on owner
         
-        user_limits = self.get('user_limits', {})
-        user_limits[str(user_id)] = limits
-        self.set('user_limits', user_limits)
+        user_limits = self.config.setdefault('user_limits', {})
+        if user_limits.get(user_id) == limits:
+            return
+        user_limits[user_id] = limits
+        self._schedule_flush()
+    
+    def update_user_limits(self, user_id: int, **fields) -> Mapping:
+        """
+        Merge fields into a user's limits with a single read-merge-write
+        The disk write is deferred so rapid edits coalesce into one save
+        Returns: updated limits
+        """
+        if self.is_owner(user_id):
+            return self._OWNER_LIMITS  # Cannot set limits on owner
+        
+        user_limits = self.config.setdefault('user_limits', {})
+        limits = user_limits.get(user_id)
+        if limits is None:
+            limits = user_limits[user_id] = dict(self.get_default_limits())
+        elif all(limits.get(k, _MISSING) == v for k, v in fields.items()):
+            return limits
+        limits.update(fields)
+        self._schedule_flush()
+        return limits
+    
+    def toggle_user_limit(self, user_id: int, key: str) -> bool:
+        """
+        Flip a boolean limit in place with one lookup
+        Returns: new value of the limit
+        """
+        if self.is_owner(user_id):
+            return self._OWNER_LIMITS[key]  # Cannot set limits on owner
+        
+        user_limits = self.config.setdefault('user_limits', {})
+        limits = user_limits.get(user_id)
+        if limits is None:
+            limits = user_limits[user_id] = dict(self.get_default_limits())
+        limits[key] = not limits[key]
+        self._schedule_flush()
+        return limits[key]
     
     def remove_user_limits(self, user_id: int) -> None:
         """Remove limits for a specific user"""
         user_limits = self.get('user_limits', {})
-        if str(user_id) in user_limits:
-            del user_limits[str(user_id)]
+        if user_limits.pop(user_id, _MISSING) is not _MISSING:
             self.set('user_limits', user_limits)
     
-    def get_all_users_with_limits(self) -> List[Dict]:
-        """Get all authorized users with their limits"""
-        authorized = self.get('authorized_users', [])
-        users_info = []
+    def _describe_users(self, user_ids: Iterable[int]) -> List[Dict]:
+        """Build user_id/is_owner/limits/username dicts for the given users"""
+        owner_id = self.owner_id
+        user_limits = self.get('user_limits', {})
+        usernames = self.get('user_usernames', {})
+        default_limits = self.get_default_limits()
         
-        for user_id in authorized:
-            limits = self.get_user_limits(user_id)
-            users_info.append({
+        users = []
+        for user_id in user_ids:
+            is_owner = user_id == owner_id
+            users.append({
                 'user_id': user_id,
-                'is_owner': self.is_owner(user_id),
-                'limits': limits
+                'is_owner': is_owner,
+                'limits': self._OWNER_LIMITS if is_owner else user_limits.get(user_id, default_limits),
+                'username': usernames.get(user_id)
             })
+        return users
+    
+    def list_users(self, offset: int = 0, limit: int = 10,
+                   exclude_owner: bool = True) -> Tuple[List[Dict], bool]:
+        """
+        Get one page of authorized users with their limits and usernames
+        Returns: (users, has_more)
+        """
+        owner_id = self.owner_id
+        user_ids = self.get('authorized_users', [])
+        if exclude_owner:
+            user_ids = [uid for uid in user_ids if uid != owner_id]
         
-        return users_info
+        return self._describe_users(user_ids[offset:offset + limit]), offset + limit < len(user_ids)
+    
+    def _sorted_user_ids(self, exclude_owner: bool) -> List[int]:
+        """Authorized user ids in ascending order, cached until the list changes"""
+        ids = self._sorted_ids.get(exclude_owner)
+        if ids is None:
+            owner_id = self.owner_id
+            ids = self._sorted_ids[exclude_owner] = sorted(
+                uid for uid in self._authorized_set if not (exclude_owner and uid == owner_id)
+            )
+        return ids
+    
+    def list_users_after(self, after: Optional[int] = None, limit: int = 10,
+                         exclude_owner: bool = True) -> Tuple[List[Dict], bool, bool]:
+        """
+        Get the users that follow the cursor, in user id order
+        Pass the last user id of the previous page, or None for the first page
+        Returns: (users, has_prev, has_more)
+        """
+        ids = self._sorted_user_ids(exclude_owner)
+        start = 0 if after is None else bisect.bisect_right(ids, after)
+        return self._describe_users(ids[start:start + limit]), start > 0, start + limit < len(ids)
+    
+    def list_users_before(self, before: int, limit: int = 10,
+                          exclude_owner: bool = True) -> Tuple[List[Dict], bool, bool]:
+        """
+        Get the users that precede the cursor, in user id order
+        Pass the first user id of the next page
+        Returns: (users, has_prev, has_more)
+        """
+        ids = self._sorted_user_ids(exclude_owner)
+        end = bisect.bisect_left(ids, before)
+        start = max(end - limit, 0)
+        return self._describe_users(ids[start:end]), start > 0, end < len(ids)
     
     def can_user_perform_action(self, user_id: int, action: str) -> bool:
         """Check if user can perform a specific action"""
@@ -13,14 +13,21 @@ from telegram.ext import (
 # Import our modules
 from config import config
 from wireguard_manager import wg_manager
-from menu_handlers import handle_menu_callback, handle_menu_text_input, MenuHandler, MessageFormatter
+from menu_handlers import (
+    handle_menu_callback, handle_menu_text_input, MenuHandler, MessageFormatter,
+    get_escaped_user_name
+)
 from utils import sanitize_client_name, validate_dns_servers, escape_markdown
+from telegram_utils import send_qr_image_robust, discard_temp_file, rate_limiter
 
 # Enable logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
+# Per-request HTTP and polling records are too chatty at INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("telegram.ext.Application").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 # Conversation states
@@ -49,7 +56,10 @@ class WireBot:
         
         # Send welcome message with main menu
         await update.message.reply_text(
-            MessageFormatter.format_main_menu(user_name),
+            await asyncio.to_thread(
+                MessageFormatter.format_main_menu,
+                user_name, get_escaped_user_name(context, user_name)
+            ),
             reply_markup=MenuHandler.create_main_menu(),
             parse_mode='MarkdownV2'
         )
@@ -76,7 +86,7 @@ class WireBot:
             return
         
         await update.message.reply_text(
-            MessageFormatter.format_server_status(),
+            await asyncio.to_thread(MessageFormatter.format_server_status),
             parse_mode='MarkdownV2'
         )
     
@@ -94,7 +104,7 @@ class WireBot:
         
         await update.message.reply_text("🔧 Installing WireGuard... This may take a few minutes.")
         
-        success, message = wg_manager.install_wireguard()
+        success, message = await asyncio.to_thread(wg_manager.install_wireguard)
         
         if success:
             await update.message.reply_text(f"✅ {message}")
@@ -124,26 +134,26 @@ class WireBot:
     
     async def add_client_name(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """Handle client name input"""
+        reply = update.message.reply_text
         client_name = update.message.text.strip()
         sanitized_name = sanitize_client_name(client_name)
         
         if not sanitized_name:
-            await update.message.reply_text(
+            await reply(
                 "❌ Invalid client name. Please use only letters, numbers, hyphens, and underscores."
             )
             return WAITING_CLIENT_NAME
         
         # Check if client already exists
-        clients = wg_manager.list_clients()
-        if any(client['name'] == sanitized_name for client in clients):
-            await update.message.reply_text(
+        if sanitized_name in wg_manager.client_names():
+            await reply(
                 f"❌ Client '{sanitized_name}' already exists. Please choose a different name."
             )
             return WAITING_CLIENT_NAME
         
         context.user_data['client_name'] = sanitized_name
         
-        await update.message.reply_text(
+        await reply(
             f"✅ Client name: *{escape_markdown(sanitized_name)}*\n\n"
             f"Now enter DNS servers \\(comma\\-separated IP addresses\\):\n"
             f"Or send /skip to use default \\(8\\.8\\.8\\.8, 8\\.8\\.4\\.4\\)",
@@ -173,71 +183,76 @@ class WireBot:
         """Create the client configuration"""
         client_name = context.user_data['client_name']
         dns_servers = context.user_data['dns_servers']
+        chat_id = update.message.chat_id
         
-        await update.message.reply_text("🔧 Creating client configuration...")
+        # This flow sends a burst of messages, so it goes through the limiter;
+        # single replies to a command are already paced by the user's input
+        def reply(*args, **kwargs):
+            return rate_limiter.call(lambda: update.message.reply_text(*args, **kwargs), chat_id)
         
-        success, message, config_file = wg_manager.add_client(client_name, dns_servers)
+        await reply("🔧 Creating client configuration...")
+        
+        success, message, config_file, config_bytes = await asyncio.to_thread(
+            wg_manager.add_client, client_name, dns_servers
+        )
         
         if success and config_file:
             # Send config file
-            await update.message.reply_document(
-                document=InputFile(config_file),
-                filename=f"{client_name}.conf",
+            await rate_limiter.call(lambda: update.message.reply_document(
+                document=InputFile(config_bytes, filename=f"{client_name}.conf"),
                 caption=f"📄 Configuration file for {client_name}"
-            )
+            ), chat_id)
             
             # Send config content in code format
-            config_success, config_message, config_content = wg_manager.get_client_config(client_name)
-            if config_success and config_content:
+            config_content = config_bytes.decode()
+            if config_content:
                 # Split long configs to avoid Telegram message limits
                 max_length = 3500  # Leave room for formatting
                 if len(config_content) > max_length:
-                    # Split into chunks
-                    chunks = [config_content[i:i+max_length] for i in range(0, len(config_content), max_length)]
-                    for i, chunk in enumerate(chunks):
-                        await update.message.reply_text(
-                            f"📄 *Config Content \\(Part {i+1}/{len(chunks)}\\)*\n\n```\n{chunk}\n```",
+                    # Split into chunks, labelling each part up front
+                    n_chunks = -(-len(config_content) // max_length)
+                    parts = [
+                        (f"Part {i + 1}/{n_chunks}", config_content[i * max_length:(i + 1) * max_length])
+                        for i in range(n_chunks)
+                    ]
+                    for header, chunk in parts:
+                        await reply(
+                            f"📄 *Config Content \\({header}\\)*\n\n```\n{chunk}\n```",
                             parse_mode='MarkdownV2'
                         )
                 else:
-                    await update.message.reply_text(
+                    await reply(
                         f"📄 *Config Content*\n\n```\n{config_content}\n```",
                         parse_mode='MarkdownV2'
                     )
             
             # Get and send QR code as image
-            qr_success, qr_message, qr_image_path = wg_manager.get_client_qr(client_name)
+            qr_success, qr_message, qr_image_path = await asyncio.to_thread(wg_manager.get_client_qr, client_name)
             if qr_success and qr_image_path:
                 try:
                     # Use robust sending method
-                    from telegram_utils import send_qr_image_robust
-                    
                     send_success, send_message = await send_qr_image_robust(
-                        context.bot, update.message.chat_id, qr_image_path, client_name
+                        context.bot, chat_id, qr_image_path, client_name
                     )
                     
                     if not send_success:
-                        await update.message.reply_text(
+                        await reply(
                             f"⚠️ QR code generated but failed to send: {send_message}\n"
                             f"You can still use the config file and text above to set up your connection."
                         )
                 finally:
                     # Clean up temporary file
-                    import os
-                    try:
-                        os.unlink(qr_image_path)
-                    except:
-                        pass
+                    discard_temp_file(qr_image_path)
             else:
-                logger.warning(f"QR code generation failed for {client_name}: {qr_message}")
-                await update.message.reply_text(
+                logger.warning("QR code generation failed for %s: %s", client_name, qr_message)
+                await reply(
                     f"⚠️ QR code generation failed: {qr_message}\n"
                     f"You can still use the config file and text above to set up your connection."
                 )
             
-            await update.message.reply_text(f"✅ {message}")
+            await reply(f"✅ {message}")
         else:
-            await update.message.reply_text(f"❌ {message}")
+            await reply(f"❌ {message}")
         
         return ConversationHandler.END
     
@@ -268,6 +283,7 @@ class WireBot:
             new_user_id = int(update.message.text.strip())
             
             if config.add_authorized_user(new_user_id):
+                await config.aflush()
                 await update.message.reply_text(f"✅ User {new_user_id} has been authorized.")
             else:
                 await update.message.reply_text(f"ℹ️ User {new_user_id} is already authorized.")
@@ -287,14 +303,14 @@ class WireBot:
             return
         
         authorized_users = config.get('authorized_users', [])
-        owner_id = config.get('owner_id')
+        owner_id = config.owner_id
         
-        message = "👥 *Authorized Users*\n\n"
+        parts = ["👥 *Authorized Users*\n\n"]
         for i, uid in enumerate(authorized_users, 1):
             role = " \\(Owner\\)" if uid == owner_id else ""
-            message += f"{i}\\. `{uid}`{role}\n"
+            parts.append(f"{i}\\. `{uid}`{role}\n")
         
-        await update.message.reply_text(message, parse_mode='MarkdownV2')
+        await update.message.reply_text(''.join(parts), parse_mode='MarkdownV2')
     
     def setup_handlers(self):
         """Setup all command and callback handlers"""
@@ -335,17 +351,34 @@ class WireBot:
         )
         self.application.add_handler(add_user_conv)
     
+    async def post_shutdown(self, application: Application) -> None:
+        """Write any deferred config changes before the loop closes"""
+        await config.aflush()
+    
     def run(self):
         """Start the bot"""
+        # Use the libuv event loop when available; asyncio's default loop otherwise
+        try:
+            import uvloop
+            uvloop.install()
+            logger.info("Using uvloop event loop")
+        except ImportError:
+            pass
+        
         # Create application
-        self.application = Application.builder().token(config.get('bot_token')).build()
+        self.application = (
+            Application.builder()
+            .token(config.bot_token)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
         
         # Setup handlers
         self.setup_handlers()
         
         logger.info("WireBot started successfully!")
-        logger.info(f"Owner ID: {config.get('owner_id')}")
-        logger.info(f"Authorized users: {len(config.get('authorized_users', []))}")
+        logger.info("Owner ID: %s", config.owner_id)
+        logger.info("Authorized users: %d", len(config.get('authorized_users', [])))
         
         # Run the bot
         self.application.run_polling()
@@ -1,145 +1,451 @@
 """
 Menu system handlers for WireBot
 """
+import asyncio
+import datetime
 import logging
 import os
-from typing import Dict, List
+import re
+import time
+import functools
+from typing import Dict, List, Optional, Tuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 from telegram.ext import ContextTypes, ConversationHandler
 from config import config
-from wireguard_manager import wg_manager
-from utils import format_file_size, format_duration, escape_markdown
+from wireguard_manager import wg_manager, BACKUP_SUFFIX, BACKUP_EXTRACT_CMD
+from telegram_utils import send_qr_image_robust, discard_temp_file, rate_limiter
+from utils import (
+    format_file_size, format_duration, escape_markdown, sanitize_client_name,
+    validate_dns_servers, read_file_cached
+)
 
 logger = logging.getLogger(__name__)
 
 # Conversation states
 WAITING_CLIENT_NAME, WAITING_DNS_SERVERS, WAITING_CONFIRM_REMOVE = range(3)
 
+# Telegram's limit for photo/document captions
+MAX_CAPTION_LENGTH = 1024
+
+# Configs longer than this are sent as a file only, not echoed as text
+MAX_CONFIG_TEXT_LENGTH = 3500
+
+# Minimum seconds between taps on the same 🔄 Refresh button per chat. The
+# window adapts to the view: short after a small render, longer after a
+# full status page. Navigation callbacks are never debounced
+REFRESH_DEBOUNCE_SHORT = 0.3
+REFRESH_DEBOUNCE_LONG = 1.0
+# Rendered views up to this many characters count as small
+REFRESH_SMALL_VIEW_CHARS = 320
+# (chat_id, callback_data) -> (last refresh time, window); pruned past this size
+_REFRESH_DEBOUNCE_MAX = 1024
+_refresh_debounce: Dict[tuple, Tuple[float, float]] = {}
+
+# Resolved @username -> (user_id, resolved_at) to skip repeat get_chat lookups
+USERNAME_CACHE_TTL = 3600
+_username_cache: Dict[str, tuple] = {}
+
+# (wg0.conf mtime_ns, message) for the backup info view
+_backup_info_cache: Optional[tuple] = None
+
+# Users shown per page in the limits screens
+USERS_PAGE_SIZE = 10
+
+# Seconds a user's client list is reused between selection screens
+CLIENT_LIST_CACHE_TTL = 5
+
+# Inputs accepted as "no limit" for numeric user limits
+_UNLIMITED = frozenset({'unlimited', 'infinite', '-1', '∞'})
+
+# Shown after a client is created from the menu
+_CLIENT_CREATED_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("➕ Add Another Client", callback_data="client_add"),
+        InlineKeyboardButton("📋 View All Clients", callback_data="client_list")
+    ],
+    [InlineKeyboardButton("⬅️ Back to Main Menu", callback_data="menu_main")]
+])
+
+# Static parts of the dashboard message around the user's name
+_MAIN_MENU_HEADER = "🤖 *WireBot Dashboard*\n\n👋 Welcome, "
+_MAIN_MENU_NOT_INSTALLED = (
+    "\\!\n\n"
+    "❌ *WireGuard not installed*\n"
+    "Use /install to set up WireGuard first\\.\n\n"
+    "📱 *Quick Actions:*\n"
+    "• Use the buttons below to navigate\n"
+    "• Type /help for command list\n"
+    "• Type /install to install WireGuard"
+)
+_MAIN_MENU_FOOTER = (
+    "📱 *Quick Actions:*\n"
+    "• Manage clients and view statistics\n"
+    "• Monitor server performance\n"
+    "• Backup and restore configurations"
+)
+
+# Help text is fully static, so it is built once
+_HELP_MSG = (
+    "ℹ️ *WireBot Help*\n\n"
+    "🤖 *Commands:*\n"
+    "• `/start` \\- Show main menu\n"
+    "• `/help` \\- Show this help\n"
+    "• `/status` \\- Quick server status\n"
+    "• `/install` \\- Install WireGuard\n\n"
+    "📱 *Navigation:*\n"
+    "• Use inline buttons to navigate\n"
+    "• Most actions have confirmation steps\n"
+    "• Use 'Back' buttons to return\n\n"
+    "👥 *Client Management:*\n"
+    "• Add new VPN clients\n"
+    "• Remove existing clients\n"
+    "• Generate QR codes\n"
+    "• Download config files\n\n"
+    "📊 *Monitoring:*\n"
+    "• View server status\n"
+    "• Check connection statistics\n"
+    "• Monitor data usage\n\n"
+    "💾 *Backup:*\n"
+    "• Create configuration backups\n"
+    "• Download all configs\n\n"
+    "🔒 *Security:*\n"
+    "• Multi\\-user support\n"
+    "• Owner\\-only admin functions\n"
+    "• Audit logging"
+)
+
+# Fixed callback replies
+_USER_LIMITS_MSG = "⚙️ *User Limits Management*\n\nConfigure user permissions and limits:"
+_INVALID_OP_MSG = "❌ Invalid operation\\."
+_UNKNOWN_ACTION_MSG = "❌ Unknown action\\. Please try again\\."
+
+# Limit prompts; format with the escaped target user id
+_SET_MAX_CLIENTS_TMPL = (
+    "📊 *Set Max Clients for User {}*\n\n"
+    "Enter the maximum number of clients this user can create\\.\n\n"
+    "💡 *Options:*\n"
+    "• Enter a number \\(e\\.g\\. `5`, `10`, `50`\\)\n"
+    "• Enter `unlimited` for no limit\n\n"
+    "📝 *Send your choice:*"
+)
+_SET_RATE_LIMIT_TMPL = (
+    "⏱️ *Set Rate Limit for User {}*\n\n"
+    "Enter the maximum requests per minute for this user\\.\n\n"
+    "💡 *Options:*\n"
+    "• Enter a number \\(e\\.g\\. `10`, `50`, `100`\\)\n"
+    "• Enter `unlimited` for no limit\n\n"
+    "📝 *Send your choice:*"
+)
+
+# Shared back buttons, reused across keyboards
+_BTN_BACK_CLIENTS = InlineKeyboardButton("⬅️ Back", callback_data="menu_clients")
+_BTN_BACK_MAIN = InlineKeyboardButton("⬅️ Back", callback_data="menu_main")
+_BTN_BACK_CONFIG = InlineKeyboardButton("⬅️ Back", callback_data="menu_config")
+_BTN_BACK_BACKUP = InlineKeyboardButton("⬅️ Back", callback_data="menu_backup")
+_BTN_BACK_USERS = InlineKeyboardButton("⬅️ Back", callback_data="menu_users")
+_BTN_BACK_LIMITS = InlineKeyboardButton("⬅️ Back", callback_data="users_limits")
+_BTN_BACK_SET_USER = InlineKeyboardButton("⬅️ Back", callback_data="limits_set_user")
+
+# Static keyboards, built once and shared by every render
+_MAIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("👥 Client Management", callback_data="menu_clients"),
+        InlineKeyboardButton("📊 Server Status", callback_data="menu_status")
+    ],
+    [
+        InlineKeyboardButton("⚙️ Server Config", callback_data="menu_config"),
+        InlineKeyboardButton("📋 Connection Stats", callback_data="menu_stats")
+    ],
+    [
+        InlineKeyboardButton("💾 Backup & Restore", callback_data="menu_backup"),
+        InlineKeyboardButton("🔒 User Management", callback_data="menu_users")
+    ],
+    [
+        InlineKeyboardButton("ℹ️ Help", callback_data="menu_help"),
+        InlineKeyboardButton("🔄 Refresh", callback_data="refresh_main")
+    ]
+])
+
+_CLIENTS_MENU_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("➕ Add Client", callback_data="client_add"),
+        InlineKeyboardButton("📋 List Clients", callback_data="client_list")
+    ],
+    [
+        InlineKeyboardButton("🗑️ Remove Client", callback_data="client_remove"),
+        InlineKeyboardButton("📱 Show QR Code", callback_data="client_qr")
+    ],
+    [
+        InlineKeyboardButton("📄 Get Config", callback_data="client_config"),
+        InlineKeyboardButton("🔄 Refresh List", callback_data="client_list")
+    ],
+    [InlineKeyboardButton("⬅️ Back to Main", callback_data="menu_main")]
+])
+
+# User management menu keyed by is_owner
+_USER_MENUS = {
+    True: InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("👥 List Users", callback_data="users_list"),
+            InlineKeyboardButton("➕ Add User", callback_data="users_add")
+        ],
+        [
+            InlineKeyboardButton("🗑️ Remove User", callback_data="users_remove"),
+            InlineKeyboardButton("⚙️ Manage Limits", callback_data="users_limits")
+        ],
+        [
+            InlineKeyboardButton("📊 User Stats", callback_data="users_stats"),
+            InlineKeyboardButton("🔧 Bulk Actions", callback_data="users_bulk")
+        ],
+        [InlineKeyboardButton("⬅️ Back to Main", callback_data="menu_main")]
+    ]),
+    False: InlineKeyboardMarkup([
+        [InlineKeyboardButton("👤 My Info", callback_data="users_info")],
+        [InlineKeyboardButton("⬅️ Back to Main", callback_data="menu_main")]
+    ])
+}
+
+_USER_LIMITS_MENU_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("👤 Set User Limits", callback_data="limits_set_user"),
+        InlineKeyboardButton("📋 View All Limits", callback_data="limits_view_all")
+    ],
+    [
+        InlineKeyboardButton("🔧 Default Limits", callback_data="limits_default"),
+        InlineKeyboardButton("📊 Limits Report", callback_data="limits_report")
+    ],
+    [
+        _BTN_BACK_USERS
+    ]
+])
+
+# Back buttons to each parent menu
+_MARKUP_BACK_LIMITS = InlineKeyboardMarkup([[
+    _BTN_BACK_LIMITS
+]])
+_MARKUP_BACK_CLIENTS = InlineKeyboardMarkup([[
+    _BTN_BACK_CLIENTS
+]])
+_MARKUP_BACK_TO_CLIENTS = InlineKeyboardMarkup([[
+    InlineKeyboardButton("⬅️ Back to Clients", callback_data="menu_clients")
+]])
+_MARKUP_BACK_CONFIG = InlineKeyboardMarkup([[
+    _BTN_BACK_CONFIG
+]])
+_MARKUP_BACK_USERS = InlineKeyboardMarkup([[
+    _BTN_BACK_USERS
+]])
+_MARKUP_BACK_BACKUP = InlineKeyboardMarkup([[
+    _BTN_BACK_BACKUP
+]])
+_MARKUP_BACK_MAIN = InlineKeyboardMarkup([[
+    InlineKeyboardButton("⬅️ Back to Main", callback_data="menu_main")
+]])
+
+# Cancel and retry prompts
+_MARKUP_CANCEL_CLIENTS = InlineKeyboardMarkup([[
+    InlineKeyboardButton("❌ Cancel", callback_data="menu_clients")
+]])
+_MARKUP_CANCEL_USERS = InlineKeyboardMarkup([[
+    InlineKeyboardButton("❌ Cancel", callback_data="menu_users")
+]])
+_MARKUP_RETRY_ADD_CLIENT = InlineKeyboardMarkup([[
+    InlineKeyboardButton("🔄 Try Again", callback_data="client_add"),
+    InlineKeyboardButton("⬅️ Back to Clients", callback_data="menu_clients")
+]])
+_MARKUP_RETRY_ADD_USER = InlineKeyboardMarkup([[
+    InlineKeyboardButton("🔄 Try Again", callback_data="users_add"),
+    _BTN_BACK_USERS
+]])
+_MARKUP_RETRY_BACKUP = InlineKeyboardMarkup([[
+    InlineKeyboardButton("🔄 Try Again", callback_data="backup_create"),
+    _BTN_BACK_BACKUP
+]])
+_MARKUP_DNS_PROMPT = InlineKeyboardMarkup([[
+    InlineKeyboardButton("🔄 Use Default DNS", callback_data="menu_use_default_dns"),
+    InlineKeyboardButton("❌ Cancel", callback_data="menu_clients")
+]])
+
+# Refreshable views
+_MARKUP_STATUS = InlineKeyboardMarkup([[
+    InlineKeyboardButton("🔄 Refresh", callback_data="refresh_status"),
+    _BTN_BACK_MAIN
+]])
+_MARKUP_CONFIG = InlineKeyboardMarkup([[
+    InlineKeyboardButton("📄 View Config File", callback_data="config_view"),
+    InlineKeyboardButton("🔄 Refresh", callback_data="refresh_config")
+], [
+    _BTN_BACK_MAIN
+]])
+_MARKUP_STATS = InlineKeyboardMarkup([[
+    InlineKeyboardButton("🔄 Refresh", callback_data="refresh_stats"),
+    _BTN_BACK_MAIN
+]])
+_MARKUP_CLIENT_LIST = InlineKeyboardMarkup([[
+    InlineKeyboardButton("🔄 Refresh", callback_data="refresh_clients"),
+    _BTN_BACK_CLIENTS
+]])
+
+# Backup screens
+_MARKUP_BACKUP_ROOT = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("📦 Create Backup", callback_data="backup_create"),
+        InlineKeyboardButton("📊 Backup Info", callback_data="backup_info")
+    ],
+    [InlineKeyboardButton("⬅️ Back to Main", callback_data="menu_main")]
+])
+_MARKUP_BACKUP_DONE = InlineKeyboardMarkup([[
+    InlineKeyboardButton("📦 Create Another", callback_data="backup_create"),
+    _BTN_BACK_BACKUP
+]])
+_MARKUP_BACKUP_INFO = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("📦 Create Backup", callback_data="backup_create"),
+        _BTN_BACK_BACKUP
+    ]
+])
+
+# User limit screens
+_MARKUP_LIMITS_NO_USERS = InlineKeyboardMarkup([[
+    InlineKeyboardButton("➕ Add User", callback_data="users_add"),
+    _BTN_BACK_LIMITS
+]])
+_MARKUP_LIMITS_OVERVIEW = InlineKeyboardMarkup([[
+    InlineKeyboardButton("⚙️ Manage Limits", callback_data="limits_set_user"),
+    _BTN_BACK_LIMITS
+]])
+
+def get_escaped_user_name(context: ContextTypes.DEFAULT_TYPE, user_name: str) -> str:
+    """Get the user's MarkdownV2-escaped display name, cached in user_data"""
+    cached = context.user_data.get('escaped_name')
+    if cached is None or cached[0] != user_name:
+        cached = (user_name, escape_markdown(user_name))
+        context.user_data['escaped_name'] = cached
+    return cached[1]
+
+async def _cached_clients(context: ContextTypes.DEFAULT_TYPE) -> List[Dict]:
+    """Get the client list, reusing this user's recent listing"""
+    now = time.monotonic()
+    cached = context.user_data.get('clients')
+    if cached is not None and now - cached[0] < CLIENT_LIST_CACHE_TTL:
+        return cached[1]
+    clients = await asyncio.to_thread(wg_manager.list_clients)
+    context.user_data['clients'] = (now, clients)
+    return clients
+
+def _parse_limit(text: str) -> int:
+    """Parse a numeric limit; -1 means unlimited. Raises ValueError on bad input"""
+    text = text.strip().lower()
+    if text in _UNLIMITED:
+        return -1
+    return max(-1, int(text))
+
+@functools.lru_cache(maxsize=32)
+def _build_selection_markup(names: tuple, connected: tuple, action: str) -> InlineKeyboardMarkup:
+    """Build a client selection keyboard; cached while the client set is unchanged"""
+    keyboard = [
+        [InlineKeyboardButton(f"{'🟢' if is_connected else '🔴'} {name}", callback_data=f"client_{action}_{name}")]
+        for name, is_connected in zip(names, connected)
+    ]
+    keyboard.append([_BTN_BACK_CLIENTS])
+    return InlineKeyboardMarkup(keyboard)
+
+@functools.lru_cache(maxsize=64)
+def _limits_user_kb(user_id: int) -> InlineKeyboardMarkup:
+    """Build the per-user limits keyboard; cached per user"""
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("📊 Max Clients", callback_data=f"set_max_clients_{user_id}"),
+            InlineKeyboardButton("⏱️ Rate Limit", callback_data=f"set_rate_limit_{user_id}")
+        ],
+        [
+            InlineKeyboardButton("💾 Backup Access", callback_data=f"toggle_backup_{user_id}"),
+            InlineKeyboardButton("📈 Stats Access", callback_data=f"toggle_stats_{user_id}")
+        ],
+        [
+            InlineKeyboardButton("👥 Client Management", callback_data=f"toggle_clients_{user_id}")
+        ],
+        [
+            InlineKeyboardButton("🔄 Reset to Default", callback_data=f"reset_limits_{user_id}"),
+            _BTN_BACK_SET_USER
+        ]
+    ])
+
+@functools.lru_cache(maxsize=64)
+def _configure_more_kb(user_id: int) -> InlineKeyboardMarkup:
+    """Build the keyboard shown after a user's limit changes"""
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("⚙️ Configure More", callback_data=f"limits_user_{user_id}"),
+        _BTN_BACK_SET_USER
+    ]])
+
+@functools.lru_cache(maxsize=64)
+def _cancel_limit_input_kb(user_id: int) -> InlineKeyboardMarkup:
+    """Build the cancel keyboard for limit value prompts"""
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("❌ Cancel", callback_data=f"limits_user_{user_id}")
+    ]])
+
+@functools.lru_cache(maxsize=64)
+def _retry_limit_input_kb(action: str, user_id: int) -> InlineKeyboardMarkup:
+    """Build the retry keyboard for invalid limit input"""
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("🔄 Try Again", callback_data=f"{action}_{user_id}"),
+        InlineKeyboardButton("⬅️ Back", callback_data=f"limits_user_{user_id}")
+    ]])
+
+def _page_nav_row(base: str, page: int, has_more: bool) -> List[InlineKeyboardButton]:
+    """Build Prev/Next buttons for a paged list; callbacks are {base}_{page}"""
+    row = []
+    if page > 0:
+        row.append(InlineKeyboardButton("◀️ Prev", callback_data=f"{base}_{page - 1}"))
+    if has_more:
+        row.append(InlineKeyboardButton("Next ▶️", callback_data=f"{base}_{page + 1}"))
+    return row
+
 class MenuHandler:
     """Handles all menu interactions and callbacks"""
     
     @staticmethod
     def create_main_menu() -> InlineKeyboardMarkup:
         """Create the main menu keyboard"""
-        keyboard = [
-            [
-                InlineKeyboardButton("👥 Client Management", callback_data="menu_clients"),
-                InlineKeyboardButton("📊 Server Status", callback_data="menu_status")
-            ],
-            [
-                InlineKeyboardButton("⚙️ Server Config", callback_data="menu_config"),
-                InlineKeyboardButton("📋 Connection Stats", callback_data="menu_stats")
-            ],
-            [
-                InlineKeyboardButton("💾 Backup & Restore", callback_data="menu_backup"),
-                InlineKeyboardButton("🔒 User Management", callback_data="menu_users")
-            ],
-            [
-                InlineKeyboardButton("ℹ️ Help", callback_data="menu_help"),
-                InlineKeyboardButton("🔄 Refresh", callback_data="menu_main")
-            ]
-        ]
-        return InlineKeyboardMarkup(keyboard)
+        return _MAIN_MENU_MARKUP
     
     @staticmethod
     def create_clients_menu() -> InlineKeyboardMarkup:
         """Create the client management menu"""
-        keyboard = [
-            [
-                InlineKeyboardButton("➕ Add Client", callback_data="client_add"),
-                InlineKeyboardButton("📋 List Clients", callback_data="client_list")
-            ],
-            [
-                InlineKeyboardButton("🗑️ Remove Client", callback_data="client_remove"),
-                InlineKeyboardButton("📱 Show QR Code", callback_data="client_qr")
-            ],
-            [
-                InlineKeyboardButton("📄 Get Config", callback_data="client_config"),
-                InlineKeyboardButton("🔄 Refresh List", callback_data="client_list")
-            ],
-            [InlineKeyboardButton("⬅️ Back to Main", callback_data="menu_main")]
-        ]
-        return InlineKeyboardMarkup(keyboard)
+        return _CLIENTS_MENU_MARKUP
     
     @staticmethod
     def create_client_selection_menu(clients: List[Dict], action: str) -> InlineKeyboardMarkup:
         """Create a menu for selecting clients"""
-        keyboard = []
-        
-        for client in clients:
-            status_emoji = "🟢" if client['status']['connected'] else "🔴"
-            button_text = f"{status_emoji} {client['name']}"
-            callback_data = f"client_{action}_{client['name']}"
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
-        
-        keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="menu_clients")])
-        return InlineKeyboardMarkup(keyboard)
+        names = tuple(client['name'] for client in clients)
+        connected = tuple(client['status']['connected'] for client in clients)
+        return _build_selection_markup(names, connected, action)
     
     @staticmethod
     def create_user_menu(is_owner: bool) -> InlineKeyboardMarkup:
         """Create user management menu"""
-        keyboard = []
-        
-        if is_owner:
-            keyboard.extend([
-                [
-                    InlineKeyboardButton("👥 List Users", callback_data="users_list"),
-                    InlineKeyboardButton("➕ Add User", callback_data="users_add")
-                ],
-                [
-                    InlineKeyboardButton("🗑️ Remove User", callback_data="users_remove"),
-                    InlineKeyboardButton("⚙️ Manage Limits", callback_data="users_limits")
-                ],
-                [
-                    InlineKeyboardButton("📊 User Stats", callback_data="users_stats"),
-                    InlineKeyboardButton("🔧 Bulk Actions", callback_data="users_bulk")
-                ]
-            ])
-        else:
-            keyboard.append([
-                InlineKeyboardButton("👤 My Info", callback_data="users_info")
-            ])
-        
-        keyboard.append([InlineKeyboardButton("⬅️ Back to Main", callback_data="menu_main")])
-        return InlineKeyboardMarkup(keyboard)
+        return _USER_MENUS[bool(is_owner)]
     
     @staticmethod
     def create_user_limits_menu() -> InlineKeyboardMarkup:
         """Create user limits management menu"""
-        keyboard = [
-            [
-                InlineKeyboardButton("👤 Set User Limits", callback_data="limits_set_user"),
-                InlineKeyboardButton("📋 View All Limits", callback_data="limits_view_all")
-            ],
-            [
-                InlineKeyboardButton("🔧 Default Limits", callback_data="limits_default"),
-                InlineKeyboardButton("📊 Limits Report", callback_data="limits_report")
-            ],
-            [
-                InlineKeyboardButton("⬅️ Back", callback_data="menu_users")
-            ]
-        ]
-        return InlineKeyboardMarkup(keyboard)
+        return _USER_LIMITS_MENU_MARKUP
 
 class MessageFormatter:
     """Formats messages for different menu screens"""
     
     @staticmethod
-    def format_main_menu(user_name: str) -> str:
-        """Format main menu message"""
+    def format_main_menu(user_name: str, escaped_name: Optional[str] = None) -> str:
+        """Format main menu message; pass escaped_name to skip re-escaping user_name"""
         server_status = wg_manager.get_server_status()
+        if escaped_name is None:
+            escaped_name = escape_markdown(user_name)
+        header = _MAIN_MENU_HEADER + escaped_name
         
         if not server_status['installed']:
-            return (
-                f"🤖 *WireBot Dashboard*\n\n"
-                f"👋 Welcome, {escape_markdown(user_name)}\\!\n\n"
-                f"❌ *WireGuard not installed*\n"
-                f"Use /install to set up WireGuard first\\.\n\n"
-                f"📱 *Quick Actions:*\n"
-                f"• Use the buttons below to navigate\n"
-                f"• Type /help for command list\n"
-                f"• Type /install to install WireGuard"
-            )
+            return header + _MAIN_MENU_NOT_INSTALLED
         
         wg_status = server_status['wireguard']
         clients = server_status.get('clients', [])
@@ -148,16 +454,12 @@ class MessageFormatter:
         status_emoji = "🟢" if wg_status.get('service_active') else "🔴"
         
         return (
-            f"🤖 *WireBot Dashboard*\n\n"
-            f"👋 Welcome, {escape_markdown(user_name)}\\!\n\n"
+            f"{header}\\!\n\n"
             f"{status_emoji} *WireGuard Status:* "
             f"{'Active' if wg_status.get('service_active') else 'Inactive'}\n"
             f"👥 *Clients:* {len(clients)} total, {connected_count} connected\n"
             f"⏱️ *Uptime:* {server_status['system'].get('uptime', 'Unknown')}\n\n"
-            f"📱 *Quick Actions:*\n"
-            f"• Manage clients and view statistics\n"
-            f"• Monitor server performance\n"
-            f"• Backup and restore configurations"
+            f"{_MAIN_MENU_FOOTER}"
         )
     
     @staticmethod
@@ -218,29 +520,36 @@ class MessageFormatter:
         if not clients:
             return "👥 *Client List*\n\nNo clients configured\\."
         
-        message = f"👥 *Client List* \\({len(clients)} total\\)\n\n"
+        parts = [f"👥 *Client List* \\({len(clients)} total\\)\n\n"]
+        append = parts.append
+        fromtimestamp = datetime.datetime.fromtimestamp
         
-        for i, client in enumerate(clients, 1):
-            status_emoji = "🟢" if client['status']['connected'] else "🔴"
-            config_emoji = "📄" if client['config_exists'] else "❌"
+        # Extract the per-client columns once instead of re-indexing nested dicts
+        names = [escape_markdown(client['name']) for client in clients]
+        statuses = [client['status'] for client in clients]
+        config_flags = [client['config_exists'] for client in clients]
+        
+        for i, (name, status, config_exists) in enumerate(zip(names, statuses, config_flags), 1):
+            status_emoji = "🟢" if status['connected'] else "🔴"
+            config_emoji = "📄" if config_exists else "❌"
             
-            message += f"{i}\\. {status_emoji} *{escape_markdown(client['name'])}*\n"
-            message += f"   📱 Config: {config_emoji}\n"
+            append(f"{i}\\. {status_emoji} *{name}*\n")
+            append(f"   📱 Config: {config_emoji}\n")
             
-            if client['status']['connected']:
-                if client['status']['transfer']:
-                    rx = format_file_size(client['status']['transfer']['rx'])
-                    tx = format_file_size(client['status']['transfer']['tx'])
-                    message += f"   📊 Transfer: ↓{rx} ↑{tx}\n"
+            if status['connected']:
+                transfer = status['transfer']
+                if transfer:
+                    rx = format_file_size(transfer['rx'])
+                    tx = format_file_size(transfer['tx'])
+                    append(f"   📊 Transfer: ↓{rx} ↑{tx}\n")
                 
-                if client['status']['last_handshake']:
-                    import datetime
-                    last_seen = datetime.datetime.fromtimestamp(client['status']['last_handshake'])
-                    message += f"   🕐 Last seen: {last_seen.strftime('%H:%M:%S')}\n"
+                if status['last_handshake']:
+                    last_seen = fromtimestamp(status['last_handshake'])
+                    append(f"   🕐 Last seen: {last_seen.strftime('%H:%M:%S')}\n")
             
-            message += "\n"
+            append("\n")
         
-        return message.rstrip()
+        return ''.join(parts).rstrip()
     
     @staticmethod
     def format_connection_stats() -> str:
@@ -263,10 +572,9 @@ class MessageFormatter:
         )
         
         if stats['connected_clients'] > 0:
-            message += f"🟢 *Active Connections:*\n"
-            for client in stats['clients']:
-                if client['status']['connected']:
-                    message += f"• {escape_markdown(client['name'])}\n"
+            active = [f"• {escape_markdown(client['name'])}\n"
+                      for client in stats['clients'] if client['status']['connected']]
+            message += f"🟢 *Active Connections:*\n" + ''.join(active)
         
         return message
     
@@ -292,15 +600,14 @@ class MessageFormatter:
         listen_port_escaped = escape_markdown(str(listen_port))
         public_key_escaped = escape_markdown(str(public_key)[:20] + "..." if len(str(public_key)) > 20 else str(public_key))
         
-        # Check if config file exists
-        config_exists = os.path.exists(config_path)
-        config_size = ""
-        if config_exists:
-            try:
-                size = os.path.getsize(config_path)
-                config_size = f" \\({escape_markdown(format_file_size(size))}\\)"
-            except:
-                config_size = ""
+        # Check if config file exists and get its size with a single stat
+        try:
+            size = os.stat(config_path).st_size
+            config_exists = True
+            config_size = f" \\({escape_markdown(format_file_size(size))}\\)"
+        except OSError:
+            config_exists = False
+            config_size = ""
         
         message = (
             f"⚙️ *Server Configuration*\n\n"
@@ -325,34 +632,7 @@ class MessageFormatter:
     @staticmethod
     def format_help_message() -> str:
         """Format help message"""
-        return (
-            f"ℹ️ *WireBot Help*\n\n"
-            f"🤖 *Commands:*\n"
-            f"• `/start` \\- Show main menu\n"
-            f"• `/help` \\- Show this help\n"
-            f"• `/status` \\- Quick server status\n"
-            f"• `/install` \\- Install WireGuard\n\n"
-            f"📱 *Navigation:*\n"
-            f"• Use inline buttons to navigate\n"
-            f"• Most actions have confirmation steps\n"
-            f"• Use 'Back' buttons to return\n\n"
-            f"👥 *Client Management:*\n"
-            f"• Add new VPN clients\n"
-            f"• Remove existing clients\n"
-            f"• Generate QR codes\n"
-            f"• Download config files\n\n"
-            f"📊 *Monitoring:*\n"
-            f"• View server status\n"
-            f"• Check connection statistics\n"
-            f"• Monitor data usage\n\n"
-            f"💾 *Backup:*\n"
-            f"• Create configuration backups\n"
-            f"• Download all configs\n\n"
-            f"🔒 *Security:*\n"
-            f"• Multi\\-user support\n"
-            f"• Owner\\-only admin functions\n"
-            f"• Audit logging"
-        )
+        return _HELP_MSG
 
 async def handle_menu_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle text input during menu-driven flows"""
@@ -368,17 +648,12 @@ async def handle_menu_text_input(update: Update, context: ContextTypes.DEFAULT_T
     if not menu_state:
         return  # Not in a menu flow, ignore
     
+    handler = _MENU_DISPATCH.get(menu_state)
+    if handler is None:
+        return
+    
     try:
-        if menu_state == 'waiting_client_name':
-            await handle_menu_client_name(update, context)
-        elif menu_state == 'waiting_dns_servers':
-            await handle_menu_dns_servers(update, context)
-        elif menu_state == 'waiting_user_id':
-            await handle_menu_user_id(update, context)
-        elif menu_state == 'waiting_max_clients':
-            await handle_menu_max_clients(update, context)
-        elif menu_state == 'waiting_rate_limit':
-            await handle_menu_rate_limit(update, context)
+        await handler(update, context)
     except Exception as e:
         logger.error(f"Error handling menu text input: {e}")
         await update.message.reply_text("❌ An error occurred. Please try again.")
@@ -386,9 +661,6 @@ async def handle_menu_text_input(update: Update, context: ContextTypes.DEFAULT_T
 
 async def handle_menu_client_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle client name input in menu flow"""
-    from utils import sanitize_client_name, escape_markdown
-    from wireguard_manager import wg_manager
-    
     client_name = update.message.text.strip()
     sanitized_name = sanitize_client_name(client_name)
     
@@ -399,8 +671,7 @@ async def handle_menu_client_name(update: Update, context: ContextTypes.DEFAULT_
         return
     
     # Check if client already exists
-    clients = wg_manager.list_clients()
-    if any(client['name'] == sanitized_name for client in clients):
+    if sanitized_name in wg_manager.client_names():
         await update.message.reply_text(
             f"❌ Client '{sanitized_name}' already exists. Please choose a different name."
         )
@@ -420,16 +691,11 @@ async def handle_menu_client_name(update: Update, context: ContextTypes.DEFAULT_
         f"• `8\\.8\\.8\\.8,8\\.8\\.4\\.4` \\(Google Primary & Secondary\\)\n\n"
         f"Or type 'default' to use Google DNS \\(8\\.8\\.8\\.8, 8\\.8\\.4\\.4\\)",
         parse_mode='MarkdownV2',
-        reply_markup=InlineKeyboardMarkup([[
-            InlineKeyboardButton("🔄 Use Default DNS", callback_data="menu_use_default_dns"),
-            InlineKeyboardButton("❌ Cancel", callback_data="menu_clients")
-        ]])
+        reply_markup=_MARKUP_DNS_PROMPT
     )
 
 async def handle_menu_dns_servers(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle DNS servers input in menu flow"""
-    from utils import validate_dns_servers
-    
     dns_input = update.message.text.strip().lower()
     
     # Handle 'default' keyword
@@ -449,111 +715,153 @@ async def handle_menu_dns_servers(update: Update, context: ContextTypes.DEFAULT_
     
     # Store DNS and create client
     context.user_data['dns_servers'] = dns_servers
-    await create_menu_client(update, context)
+    await create_menu_client(update.message.chat_id, context)
 
-async def create_menu_client(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Create client from menu flow"""
-    from utils import escape_markdown
-    from wireguard_manager import wg_manager
-    from telegram import InputFile
-    
+async def create_menu_client(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Create client from menu flow, sending all output to chat_id"""
     client_name = context.user_data['client_name']
     dns_servers = context.user_data['dns_servers']
     
     # Send creating message
-    creating_msg = await update.message.reply_text("🔧 Creating client configuration...")
+    creating_msg = await rate_limiter.call(
+        lambda: context.bot.send_message(chat_id, "🔧 Creating client configuration..."), chat_id
+    )
     
     try:
-        success, message, config_file = wg_manager.add_client(client_name, dns_servers)
+        success, message, config_file, config_bytes = await asyncio.to_thread(
+            wg_manager.add_client, client_name, dns_servers
+        )
         
         if success and config_file:
-            # Send config file
-            await update.message.reply_document(
-                document=InputFile(config_file),
-                filename=f"{client_name}.conf",
-                caption=f"📄 Configuration file for {client_name}"
+            # Send config file while the QR image is rendered off the event loop.
+            # The client already exists here, so a failed upload is reported as
+            # a send failure below and the QR temp file still reaches send_qr()
+            document_result, qr_generated = await asyncio.gather(
+                rate_limiter.call(lambda: context.bot.send_document(
+                    chat_id,
+                    document=InputFile(config_bytes, filename=f"{client_name}.conf"),
+                    caption=f"📄 Configuration file for {client_name}"
+                ), chat_id),
+                asyncio.to_thread(wg_manager.get_client_qr, client_name),
+                return_exceptions=True
             )
+            if isinstance(qr_generated, Exception):
+                qr_success, qr_message, qr_image_path = False, str(qr_generated), None
+            else:
+                qr_success, qr_message, qr_image_path = qr_generated
+            config_content = config_bytes.decode()
             
-            # Send config content in code format
-            config_success, config_message, config_content = wg_manager.get_client_config(client_name)
-            if config_success and config_content:
-                # Split long configs to avoid Telegram message limits
-                max_length = 3500
-                if len(config_content) > max_length:
-                    chunks = [config_content[i:i+max_length] for i in range(0, len(config_content), max_length)]
-                    for i, chunk in enumerate(chunks):
-                        await update.message.reply_text(
-                            f"📄 *Config Content \\(Part {i+1}/{len(chunks)}\\)*\n\n```\n{chunk}\n```",
-                            parse_mode='MarkdownV2'
-                        )
-                else:
-                    await update.message.reply_text(
+            escaped_name = escape_markdown(client_name)
+            success_text = (
+                f"✅ {escape_markdown(message)}\n\n"
+                f"Client *{escaped_name}* has been created successfully\\!"
+            )
+            # The QR photo carries the success text and menu when it fits in a
+            # caption, saving a separate message. Telegram cannot group a
+            # document and a photo into one album, so those stay two sends
+            qr_caption = (
+                f"📱 QR Code for {escaped_name}\n\n"
+                f"Scan this with your WireGuard app to connect\\!\n\n"
+                f"{success_text}"
+            )
+            qr_carries_menu = bool(qr_success and qr_image_path) and len(qr_caption) <= MAX_CAPTION_LENGTH
+            
+            async def send_content() -> None:
+                """Send config content in code format, noting a failed .conf upload first"""
+                if isinstance(document_result, Exception):
+                    logger.error(f"Error sending config file for {client_name}: {document_result}")
+                    await rate_limiter.call(lambda: context.bot.send_message(
+                        chat_id,
+                        f"⚠️ Config file failed to send: {document_result}\n"
+                        f"The client was created; use Get Config File in the client list to fetch it again."
+                    ), chat_id)
+                # Longer configs are only delivered as the .conf file above
+                # rather than as several messages
+                if config_content and len(config_content) <= MAX_CONFIG_TEXT_LENGTH:
+                    await rate_limiter.call(lambda: context.bot.send_message(
+                        chat_id,
                         f"📄 *Config Content*\n\n```\n{config_content}\n```",
                         parse_mode='MarkdownV2'
-                    )
+                    ), chat_id)
             
-            # Send QR code as image
-            qr_success, qr_message, qr_image_path = wg_manager.get_client_qr(client_name)
-            if qr_success and qr_image_path:
+            async def send_qr() -> bool:
+                """
+                Send the QR code image, or a warning when it can't be sent
+                Returns: True if the QR caption carried the success text
+                """
+                if not (qr_success and qr_image_path):
+                    logger.warning(f"QR code generation failed for {client_name}: {qr_message}")
+                    await rate_limiter.call(lambda: context.bot.send_message(
+                        chat_id,
+                        f"⚠️ QR code generation failed: {qr_message}\n"
+                        f"You can still use the config file and text above to set up your connection."
+                    ), chat_id)
+                    return False
                 try:
                     # Use robust sending method
-                    from telegram_utils import send_qr_image_robust
-                    
-                    send_success, send_message = await send_qr_image_robust(
-                        context.bot, update.message.chat_id, qr_image_path, client_name
-                    )
+                    if qr_carries_menu:
+                        send_success, send_message = await send_qr_image_robust(
+                            context.bot, chat_id, qr_image_path, client_name,
+                            caption=qr_caption, parse_mode='MarkdownV2',
+                            reply_markup=_CLIENT_CREATED_MARKUP
+                        )
+                        caption_sent = send_success
+                    else:
+                        send_success, send_message = await send_qr_image_robust(
+                            context.bot, chat_id, qr_image_path, client_name
+                        )
+                        caption_sent = False
                     
                     if not send_success:
-                        await update.message.reply_text(
+                        await rate_limiter.call(lambda: context.bot.send_message(
+                            chat_id,
                             f"⚠️ QR code generated but failed to send: {send_message}\n"
                             f"You can still use the config file and text above to set up your connection."
-                        )
+                        ), chat_id)
+                    return caption_sent
                 finally:
                     # Clean up temporary file
-                    try:
-                        import os as os_module
-                        os_module.unlink(qr_image_path)
-                    except:
-                        pass
+                    discard_temp_file(qr_image_path)
+            
+            # A failure in one send doesn't hold back the other. When the QR
+            # caption carries the menu it goes after the config text so the menu
+            # stays at the bottom of the chat; otherwise the two are sent together
+            if qr_carries_menu:
+                content_result, = await asyncio.gather(send_content(), return_exceptions=True)
+                qr_result, = await asyncio.gather(send_qr(), return_exceptions=True)
             else:
-                logger.warning(f"QR code generation failed for {client_name}: {qr_message}")
-                await update.message.reply_text(
-                    f"⚠️ QR code generation failed: {qr_message}\n"
-                    f"You can still use the config file and text above to set up your connection."
+                content_result, qr_result = await asyncio.gather(
+                    send_content(), send_qr(), return_exceptions=True
                 )
+            if isinstance(content_result, Exception):
+                logger.error(f"Error sending config content for {client_name}: {content_result}")
+            if isinstance(qr_result, Exception):
+                logger.error(f"Error sending QR code for {client_name}: {qr_result}")
+            success_sent = qr_result is True
             
-            # Send success message with menu
-            await update.message.reply_text(
-                f"✅ {escape_markdown(message)}\n\n"
-                f"Client *{escape_markdown(client_name)}* has been created successfully\\!",
-                parse_mode='MarkdownV2',
-                reply_markup=InlineKeyboardMarkup([
-                    [
-                        InlineKeyboardButton("➕ Add Another Client", callback_data="client_add"),
-                        InlineKeyboardButton("📋 View All Clients", callback_data="client_list")
-                    ],
-                    [InlineKeyboardButton("⬅️ Back to Main Menu", callback_data="menu_main")]
-                ])
-            )
+            # Send success message with menu unless the QR caption carried it
+            if not success_sent:
+                await rate_limiter.call(lambda: context.bot.send_message(
+                    chat_id,
+                    success_text,
+                    parse_mode='MarkdownV2',
+                    reply_markup=_CLIENT_CREATED_MARKUP
+                ), chat_id)
         else:
-            await update.message.reply_text(
+            await rate_limiter.call(lambda: context.bot.send_message(
+                chat_id,
                 f"❌ {escape_markdown(message)}",
                 parse_mode='MarkdownV2',
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("🔄 Try Again", callback_data="client_add"),
-                    InlineKeyboardButton("⬅️ Back to Clients", callback_data="menu_clients")
-                ]])
-            )
+                reply_markup=_MARKUP_RETRY_ADD_CLIENT
+            ), chat_id)
     
     except Exception as e:
         logger.error(f"Error creating client: {e}")
-        await update.message.reply_text(
+        await rate_limiter.call(lambda: context.bot.send_message(
+            chat_id,
             "❌ An error occurred while creating the client. Please try again.",
-            reply_markup=InlineKeyboardMarkup([[
-                InlineKeyboardButton("🔄 Try Again", callback_data="client_add"),
-                InlineKeyboardButton("⬅️ Back to Clients", callback_data="menu_clients")
-            ]])
-        )
+            reply_markup=_MARKUP_RETRY_ADD_CLIENT
+        ), chat_id)
     
     finally:
         # Clean up user data
@@ -588,11 +896,17 @@ async def resolve_user_identifier(context, user_input: str):
     if not username.replace('_', '').isalnum() or len(username) < 5:
         return False, None, None, "Invalid username format. Usernames must be at least 5 characters and contain only letters, numbers, and underscores."
     
+    cache_key = username.lower()
+    cached = _username_cache.get(cache_key)
+    if cached is not None and time.monotonic() - cached[1] < USERNAME_CACHE_TTL:
+        return True, cached[0], username, ""
+    
     try:
         # Try to get user info using the bot's get_chat method
         # This works if the user has interacted with the bot or is in a mutual group
         chat = await context.bot.get_chat(f"@{username}")
         if chat.type == 'private' and chat.id:
+            _username_cache[cache_key] = (chat.id, time.monotonic())
             return True, chat.id, username, ""
         else:
             return False, None, None, f"Could not resolve username @{username}. The user may need to start the bot first or the username might not exist."
@@ -608,8 +922,6 @@ async def resolve_user_identifier(context, user_input: str):
 
 async def handle_menu_user_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle user ID or username input in menu flow"""
-    from utils import escape_markdown
-    
     user_id = update.effective_user.id
     
     # Check if user is owner
@@ -631,10 +943,7 @@ async def handle_menu_user_id(update: Update, context: ContextTypes.DEFAULT_TYPE
             f"• Using the numeric User ID instead\n"
             f"• Asking the user to start the bot first\n"
             f"• Checking the username spelling",
-            reply_markup=InlineKeyboardMarkup([[
-                InlineKeyboardButton("🔄 Try Again", callback_data="users_add"),
-                InlineKeyboardButton("⬅️ Back", callback_data="menu_users")
-            ]]),
+            reply_markup=_MARKUP_RETRY_ADD_USER,
             parse_mode='MarkdownV2'
         )
         return  # Don't clear user_data, let them try again
@@ -647,7 +956,7 @@ async def handle_menu_user_id(update: Update, context: ContextTypes.DEFAULT_TYPE
             f"User {escape_markdown(display_name)} \\(`{new_user_id}`\\) is already in the authorized users list\\.",
             reply_markup=InlineKeyboardMarkup([[
                 InlineKeyboardButton("⚙️ Manage Limits", callback_data=f"limits_user_{new_user_id}"),
-                InlineKeyboardButton("⬅️ Back", callback_data="menu_users")
+                _BTN_BACK_USERS
             ]]),
             parse_mode='MarkdownV2'
         )
@@ -657,14 +966,9 @@ async def handle_menu_user_id(update: Update, context: ContextTypes.DEFAULT_TYPE
     # Add the user
     if config.add_authorized_user(new_user_id, username):
         # Set default limits for new user
-        default_limits = {
-            'max_clients': config.get('limits.max_clients', 100),
-            'rate_limit': config.get('limits.rate_limit', 10),
-            'can_backup': True,
-            'can_view_stats': True,
-            'can_manage_clients': True
-        }
+        default_limits = dict(config.get_default_limits())
         config.set_user_limits(new_user_id, default_limits)
+        await config.aflush()
         
         display_name = f"@{username}" if username else str(new_user_id)
         
@@ -679,7 +983,7 @@ async def handle_menu_user_id(update: Update, context: ContextTypes.DEFAULT_TYPE
             reply_markup=InlineKeyboardMarkup([[
                 InlineKeyboardButton("⚙️ Set Custom Limits", callback_data=f"limits_user_{new_user_id}"),
                 InlineKeyboardButton("➕ Add Another", callback_data="users_add"),
-                InlineKeyboardButton("⬅️ Back", callback_data="menu_users")
+                _BTN_BACK_USERS
             ]]),
             parse_mode='MarkdownV2'
         )
@@ -687,10 +991,7 @@ async def handle_menu_user_id(update: Update, context: ContextTypes.DEFAULT_TYPE
         display_name = f"@{username}" if username else str(new_user_id)
         await update.message.reply_text(
             f"❌ Failed to add user {escape_markdown(display_name)}\\. Please try again\\.",
-            reply_markup=InlineKeyboardMarkup([[
-                InlineKeyboardButton("🔄 Try Again", callback_data="users_add"),
-                InlineKeyboardButton("⬅️ Back", callback_data="menu_users")
-            ]]),
+            reply_markup=_MARKUP_RETRY_ADD_USER,
             parse_mode='MarkdownV2'
         )
     
@@ -698,8 +999,6 @@ async def handle_menu_user_id(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def handle_menu_max_clients(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle max clients input in menu flow"""
-    from utils import escape_markdown
-    
     user_id = update.effective_user.id
     
     # Check if user is owner
@@ -715,29 +1014,18 @@ async def handle_menu_max_clients(update: Update, context: ContextTypes.DEFAULT_
         return
     
     try:
-        max_clients_input = update.message.text.strip().lower()
-        
-        if max_clients_input in ['unlimited', 'infinite', '-1', '∞']:
-            max_clients = -1
-        else:
-            max_clients = int(max_clients_input)
-            if max_clients < 0:
-                max_clients = -1
+        max_clients = _parse_limit(update.message.text)
         
         # Update user limits
-        current_limits = config.get_user_limits(target_user_id)
-        current_limits['max_clients'] = max_clients
-        config.set_user_limits(target_user_id, current_limits)
+        config.update_user_limits(target_user_id, max_clients=max_clients)
+        await config.aflush()
         
         max_display = "Unlimited" if max_clients == -1 else str(max_clients)
         
         await update.message.reply_text(
             f"✅ *Max Clients Updated*\n\n"
             f"User `{target_user_id}` can now create up to {escape_markdown(max_display)} clients\\.",
-            reply_markup=InlineKeyboardMarkup([[
-                InlineKeyboardButton("⚙️ Configure More", callback_data=f"limits_user_{target_user_id}"),
-                InlineKeyboardButton("⬅️ Back", callback_data="limits_set_user")
-            ]]),
+            reply_markup=_configure_more_kb(target_user_id),
             parse_mode='MarkdownV2'
         )
     
@@ -746,10 +1034,7 @@ async def handle_menu_max_clients(update: Update, context: ContextTypes.DEFAULT_
             "❌ *Invalid Input*\n\n"
             "Please enter a number or 'unlimited'\\.\n\n"
             "💡 *Examples:* `5`, `10`, `unlimited`",
-            reply_markup=InlineKeyboardMarkup([[
-                InlineKeyboardButton("🔄 Try Again", callback_data=f"set_max_clients_{target_user_id}"),
-                InlineKeyboardButton("⬅️ Back", callback_data=f"limits_user_{target_user_id}")
-            ]]),
+            reply_markup=_retry_limit_input_kb("set_max_clients", target_user_id),
             parse_mode='MarkdownV2'
         )
         return  # Don't clear user_data, let them try again
@@ -758,8 +1043,6 @@ async def handle_menu_max_clients(update: Update, context: ContextTypes.DEFAULT_
 
 async def handle_menu_rate_limit(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle rate limit input in menu flow"""
-    from utils import escape_markdown
-    
     user_id = update.effective_user.id
     
     # Check if user is owner
@@ -775,29 +1058,18 @@ async def handle_menu_rate_limit(update: Update, context: ContextTypes.DEFAULT_T
         return
     
     try:
-        rate_limit_input = update.message.text.strip().lower()
-        
-        if rate_limit_input in ['unlimited', 'infinite', '-1', '∞']:
-            rate_limit = -1
-        else:
-            rate_limit = int(rate_limit_input)
-            if rate_limit < 0:
-                rate_limit = -1
+        rate_limit = _parse_limit(update.message.text)
         
         # Update user limits
-        current_limits = config.get_user_limits(target_user_id)
-        current_limits['rate_limit'] = rate_limit
-        config.set_user_limits(target_user_id, current_limits)
+        config.update_user_limits(target_user_id, rate_limit=rate_limit)
+        await config.aflush()
         
         rate_display = "Unlimited" if rate_limit == -1 else f"{rate_limit}/min"
         
         await update.message.reply_text(
             f"✅ *Rate Limit Updated*\n\n"
             f"User `{target_user_id}` rate limit set to {escape_markdown(rate_display)}\\.",
-            reply_markup=InlineKeyboardMarkup([[
-                InlineKeyboardButton("⚙️ Configure More", callback_data=f"limits_user_{target_user_id}"),
-                InlineKeyboardButton("⬅️ Back", callback_data="limits_set_user")
-            ]]),
+            reply_markup=_configure_more_kb(target_user_id),
             parse_mode='MarkdownV2'
         )
     
@@ -806,977 +1078,1034 @@ async def handle_menu_rate_limit(update: Update, context: ContextTypes.DEFAULT_T
             "❌ *Invalid Input*\n\n"
             "Please enter a number or 'unlimited'\\.\n\n"
             "💡 *Examples:* `10`, `50`, `unlimited`",
-            reply_markup=InlineKeyboardMarkup([[
-                InlineKeyboardButton("🔄 Try Again", callback_data=f"set_rate_limit_{target_user_id}"),
-                InlineKeyboardButton("⬅️ Back", callback_data=f"limits_user_{target_user_id}")
-            ]]),
+            reply_markup=_retry_limit_input_kb("set_rate_limit", target_user_id),
             parse_mode='MarkdownV2'
         )
         return  # Don't clear user_data, let them try again
     
     context.user_data.clear()
 
-async def handle_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle all menu callback queries"""
-    query = update.callback_query
-    await query.answer()
-    
-    user_id = update.effective_user.id
-    user_name = update.effective_user.first_name or "User"
-    
-    # Check authorization
-    if not config.is_authorized(user_id):
-        await query.edit_message_text(
-            "❌ *Access Denied*\n\nYou are not authorized to use this bot\\.",
-            parse_mode='MarkdownV2'
-        )
+# Text input handlers keyed by the menu_state stored in user_data
+_MENU_DISPATCH = {
+    'waiting_client_name': handle_menu_client_name,
+    'waiting_dns_servers': handle_menu_dns_servers,
+    'waiting_user_id': handle_menu_user_id,
+    'waiting_max_clients': handle_menu_max_clients,
+    'waiting_rate_limit': handle_menu_rate_limit,
+}
+
+async def safe_edit(query, context: ContextTypes.DEFAULT_TYPE, text: str,
+                    reply_markup: Optional[InlineKeyboardMarkup] = None,
+                    parse_mode: Optional[str] = None) -> None:
+    """
+    Edit a callback's message, skipping the API call when it already shows
+    the same text and keyboard (Telegram rejects those as "not modified")
+    """
+    render = (query.message.message_id, text, reply_markup)
+    if context.chat_data.get('last_render') == render:
         return
+    await rate_limiter.call(
+        lambda: query.edit_message_text(text, reply_markup=reply_markup, parse_mode=parse_mode),
+        query.message.chat_id
+    )
+    context.chat_data['last_render'] = render
+
+# Access-denied keyboards for owner_only, keyed by the menu the Back button returns to
+_DENIED_MARKUPS = {
+    "menu_users": _MARKUP_BACK_USERS,
+    "users_limits": _MARKUP_BACK_LIMITS,
+}
+
+def owner_only(back: str):
+    """Restrict a callback handler to the owner; others get an access-denied reply"""
+    reply_markup = _DENIED_MARKUPS[back]
     
-    callback_data = query.data
-    
-    try:
-        if callback_data == "menu_main":
-            await query.edit_message_text(
-                MessageFormatter.format_main_menu(user_name),
-                reply_markup=MenuHandler.create_main_menu(),
-                parse_mode='MarkdownV2'
-            )
-        
-        elif callback_data == "menu_clients":
-            await query.edit_message_text(
-                "👥 *Client Management*\n\nChoose an action:",
-                reply_markup=MenuHandler.create_clients_menu(),
-                parse_mode='MarkdownV2'
-            )
-        
-        elif callback_data == "menu_status":
-            await query.edit_message_text(
-                MessageFormatter.format_server_status(),
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("🔄 Refresh", callback_data="menu_status"),
-                    InlineKeyboardButton("⬅️ Back", callback_data="menu_main")
-                ]]),
-                parse_mode='MarkdownV2'
-            )
-        
-        elif callback_data == "menu_config":
-            await query.edit_message_text(
-                MessageFormatter.format_server_config(),
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("📄 View Config File", callback_data="config_view"),
-                    InlineKeyboardButton("🔄 Refresh", callback_data="menu_config")
-                ], [
-                    InlineKeyboardButton("⬅️ Back", callback_data="menu_main")
-                ]]),
-                parse_mode='MarkdownV2'
-            )
-        
-        elif callback_data == "config_view":
-            # Show server config file content
-            try:
-                config_path = "/etc/wireguard/wg0.conf"
-                if os.path.exists(config_path):
-                    with open(config_path, 'r') as f:
-                        config_content = f.read().strip()
-                    
-                    if config_content:
-                        # Send config content in code format
-                        formatted_content = f"```\n{config_content}\n```"
-                        
-                        # Also send as file
-                        with open(config_path, 'rb') as f:
-                            await context.bot.send_document(
-                                chat_id=query.message.chat_id,
-                                document=f,
-                                filename="wg0.conf",
-                                caption="📄 Server Configuration File"
-                            )
-                        
-                        await query.edit_message_text(
-                            f"📄 *Server Configuration*\n\n"
-                            f"{formatted_content}\n\n"
-                            f"📁 File sent above as download\\.",
-                            reply_markup=InlineKeyboardMarkup([[
-                                InlineKeyboardButton("⬅️ Back", callback_data="menu_config")
-                            ]]),
-                            parse_mode='MarkdownV2'
-                        )
-                    else:
-                        await query.edit_message_text(
-                            "❌ Server configuration file is empty\\.",
-                            reply_markup=InlineKeyboardMarkup([[
-                                InlineKeyboardButton("⬅️ Back", callback_data="menu_config")
-                            ]]),
-                            parse_mode='MarkdownV2'
-                        )
-                else:
-                    await query.edit_message_text(
-                        "❌ Server configuration file not found\\.\n\n"
-                        "WireGuard may not be installed or configured\\.",
-                        reply_markup=InlineKeyboardMarkup([[
-                            InlineKeyboardButton("⬅️ Back", callback_data="menu_config")
-                        ]]),
-                        parse_mode='MarkdownV2'
-                    )
-            except Exception as e:
-                logger.error(f"Error viewing config file: {e}")
-                await query.edit_message_text(
-                    f"❌ Error reading configuration file\\.\n\n"
-                    f"Error: {escape_markdown(str(e))}",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back", callback_data="menu_config")
-                    ]]),
-                    parse_mode='MarkdownV2'
-                )
-        
-        elif callback_data == "menu_stats":
-            await query.edit_message_text(
-                MessageFormatter.format_connection_stats(),
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("🔄 Refresh", callback_data="menu_stats"),
-                    InlineKeyboardButton("⬅️ Back", callback_data="menu_main")
-                ]]),
-                parse_mode='MarkdownV2'
-            )
-        
-        elif callback_data == "client_list":
-            clients = wg_manager.list_clients()
-            await query.edit_message_text(
-                MessageFormatter.format_client_list(clients),
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("🔄 Refresh", callback_data="client_list"),
-                    InlineKeyboardButton("⬅️ Back", callback_data="menu_clients")
-                ]]),
-                parse_mode='MarkdownV2'
-            )
-        
-        elif callback_data in ["client_remove", "client_qr", "client_config"]:
-            clients = wg_manager.list_clients()
-            if not clients:
-                await query.edit_message_text(
-                    "❌ No clients found\\.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back", callback_data="menu_clients")
-                    ]]),
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                          arg: Optional[str], is_owner: bool) -> None:
+            if not is_owner:
+                await safe_edit(
+                    query, context,
+                    "❌ Access denied\\.",
+                    reply_markup=reply_markup,
                     parse_mode='MarkdownV2'
                 )
                 return
-            
-            action = callback_data.split('_')[1]
-            action_text = {
-                'remove': 'remove',
-                'qr': 'show QR code for',
-                'config': 'get config for'
-            }[action]
-            
-            await query.edit_message_text(
-                f"Select a client to {action_text}:",
-                reply_markup=MenuHandler.create_client_selection_menu(clients, action),
-                parse_mode='MarkdownV2'
-            )
-        
-        elif callback_data.startswith("client_qr_"):
-            client_name = callback_data[10:]  # Remove "client_qr_" prefix
-            
-            await query.edit_message_text(
-                f"📱 Generating QR code for {escape_markdown(client_name)}\\.\\.\\.",
-                parse_mode='MarkdownV2'
-            )
-            
-            success, message, qr_image_path = wg_manager.get_client_qr(client_name)
-            
-            if success and qr_image_path:
-                try:
-                    # Use robust sending method
-                    from telegram_utils import send_qr_image_robust
-                    
-                    send_success, send_message = await send_qr_image_robust(
-                        context.bot, query.message.chat_id, qr_image_path, client_name
-                    )
-                    
-                    if send_success:
-                        await query.edit_message_text(
-                            f"✅ QR code sent for {escape_markdown(client_name)}\\!\n\n"
-                            f"📱 {escape_markdown(send_message)}",
-                            reply_markup=InlineKeyboardMarkup([[
-                                InlineKeyboardButton("⬅️ Back", callback_data="menu_clients")
-                            ]]),
-                            parse_mode='MarkdownV2'
-                        )
-                    else:
-                        await query.edit_message_text(
-                            f"⚠️ QR code generated but failed to send\\.\n\n"
-                            f"Error: {escape_markdown(send_message)}\n\n"
-                            f"You can still get the config file to import manually\\.",
-                            reply_markup=InlineKeyboardMarkup([[
-                                InlineKeyboardButton("🔄 Try Again", callback_data=f"client_qr_{client_name}"),
-                                InlineKeyboardButton("📄 Get Config Instead", callback_data=f"client_config_{client_name}"),
-                                InlineKeyboardButton("⬅️ Back", callback_data="menu_clients")
-                            ]]),
-                            parse_mode='MarkdownV2'
-                        )
-                finally:
-                    # Clean up temporary file
-                    try:
-                        import os as os_module
-                        os_module.unlink(qr_image_path)
-                    except:
-                        pass
-            else:
-                await query.edit_message_text(
-                    f"❌ QR Code Error: {escape_markdown(message)}\n\n"
-                    f"You can still download the config file and import it manually\\.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("📄 Get Config File", callback_data=f"client_config_{client_name}"),
-                        InlineKeyboardButton("⬅️ Back", callback_data="menu_clients")
-                    ]]),
-                    parse_mode='MarkdownV2'
-                )
-        
-        elif callback_data.startswith("client_config_"):
-            client_name = callback_data[14:]  # Remove "client_config_" prefix
-            success, message, config_content = wg_manager.get_client_config(client_name)
-            
-            if success and config_content:
-                # Send config as file
-                config_file = f"{client_name}.conf"
-                await context.bot.send_document(
-                    chat_id=query.message.chat_id,
-                    document=InputFile(config_content.encode(), filename=config_file),
-                    caption=f"📄 Configuration file for {client_name}"
-                )
+            await handler(update, context, query, arg, is_owner)
+        return wrapper
+    return decorator
+
+async def _h_menu_main(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                       arg: Optional[str], is_owner: bool) -> None:
+    """Show the main dashboard"""
+    user_name = update.effective_user.first_name or "User"
+    
+    await safe_edit(
+        query, context,
+        await asyncio.to_thread(
+            MessageFormatter.format_main_menu,
+            user_name, get_escaped_user_name(context, user_name)
+        ),
+        reply_markup=MenuHandler.create_main_menu(),
+        parse_mode='MarkdownV2'
+    )
+
+async def _h_menu_clients(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                          arg: Optional[str], is_owner: bool) -> None:
+    """Show the client management menu"""
+    await safe_edit(
+        query, context,
+        "👥 *Client Management*\n\nChoose an action:",
+        reply_markup=MenuHandler.create_clients_menu(),
+        parse_mode='MarkdownV2'
+    )
+
+async def _h_menu_status(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                         arg: Optional[str], is_owner: bool) -> None:
+    """Show server status"""
+    await safe_edit(
+        query, context,
+        await asyncio.to_thread(MessageFormatter.format_server_status),
+        reply_markup=_MARKUP_STATUS,
+        parse_mode='MarkdownV2'
+    )
+
+async def _h_menu_config(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                         arg: Optional[str], is_owner: bool) -> None:
+    """Show server configuration summary"""
+    await safe_edit(
+        query, context,
+        await asyncio.to_thread(MessageFormatter.format_server_config),
+        reply_markup=_MARKUP_CONFIG,
+        parse_mode='MarkdownV2'
+    )
+
+async def _h_config_view(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                         arg: Optional[str], is_owner: bool) -> None:
+    """Send the server config file and show its content"""
+    # Show server config file content
+    try:
+        config_path = "/etc/wireguard/wg0.conf"
+        try:
+            # Serve both the text and the file from one (cached) read
+            config_data = await asyncio.to_thread(read_file_cached, config_path)
+        except FileNotFoundError:
+            config_data = None
+        
+        if config_data is not None:
+            if config_data.strip():
+                # Decode only the prefix that fits in a message; the full
+                # content goes out as the document
+                truncated = len(config_data) > MAX_CONFIG_TEXT_LENGTH
+                config_content = config_data[:MAX_CONFIG_TEXT_LENGTH].decode('utf-8', 'replace').strip()
                 
-                # Also send config content in code format
-                # Split long configs to avoid Telegram message limits
-                max_length = 3500  # Leave room for formatting
-                if len(config_content) > max_length:
-                    # Split into chunks
-                    chunks = [config_content[i:i+max_length] for i in range(0, len(config_content), max_length)]
-                    for i, chunk in enumerate(chunks):
-                        await context.bot.send_message(
-                            chat_id=query.message.chat_id,
-                            text=f"📄 *Config Content for {escape_markdown(client_name)} \\(Part {i+1}/{len(chunks)}\\)*\n\n```\n{chunk}\n```",
-                            parse_mode='MarkdownV2'
-                        )
-                else:
-                    await context.bot.send_message(
-                        chat_id=query.message.chat_id,
-                        text=f"📄 *Config Content for {escape_markdown(client_name)}*\n\n```\n{config_content}\n```",
-                        parse_mode='MarkdownV2'
-                    )
+                # Send config content in code format
+                formatted_content = f"```\n{config_content}\n```"
+                if truncated:
+                    formatted_content += "\n…\\(truncated, see file\\)"
                 
-                await query.edit_message_text(
-                    f"✅ Config file and content sent for {escape_markdown(client_name)}",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back", callback_data="menu_clients")
-                    ]]),
+                # Also send as file
+                chat_id = query.message.chat_id
+                await rate_limiter.call(lambda: context.bot.send_document(
+                    chat_id=chat_id,
+                    document=InputFile(config_data, filename="wg0.conf"),
+                    caption="📄 Server Configuration File"
+                ), chat_id)
+                
+                await safe_edit(
+                    query, context,
+                    f"📄 *Server Configuration*\n\n"
+                    f"{formatted_content}\n\n"
+                    f"📁 File sent above as download\\.",
+                    reply_markup=_MARKUP_BACK_CONFIG,
                     parse_mode='MarkdownV2'
                 )
             else:
-                await query.edit_message_text(
-                    f"❌ {escape_markdown(message)}",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back", callback_data="menu_clients")
-                    ]]),
+                await safe_edit(
+                    query, context,
+                    "❌ Server configuration file is empty\\.",
+                    reply_markup=_MARKUP_BACK_CONFIG,
                     parse_mode='MarkdownV2'
                 )
-        
-        elif callback_data.startswith("client_remove_"):
-            client_name = callback_data[14:]  # Remove "client_remove_" prefix
-            
-            # Show confirmation dialog
-            await query.edit_message_text(
-                f"🗑️ *Remove Client*\n\n"
-                f"Are you sure you want to remove client '{escape_markdown(client_name)}'?\n\n"
-                f"⚠️ This action cannot be undone\\!",
-                reply_markup=InlineKeyboardMarkup([
-                    [
-                        InlineKeyboardButton("✅ Yes, Remove", callback_data=f"confirm_remove_{client_name}"),
-                        InlineKeyboardButton("❌ Cancel", callback_data="menu_clients")
-                    ]
-                ]),
+        else:
+            await safe_edit(
+                query, context,
+                "❌ Server configuration file not found\\.\n\n"
+                "WireGuard may not be installed or configured\\.",
+                reply_markup=_MARKUP_BACK_CONFIG,
                 parse_mode='MarkdownV2'
             )
-        
-        elif callback_data.startswith("confirm_remove_"):
-            client_name = callback_data[15:]  # Remove "confirm_remove_" prefix
-            
-            await query.edit_message_text(
-                f"🗑️ Removing client '{escape_markdown(client_name)}'\\.\\.\\.",
-                parse_mode='MarkdownV2'
+    except Exception as e:
+        logger.error(f"Error viewing config file: {e}")
+        await safe_edit(
+            query, context,
+            f"❌ Error reading configuration file\\.\n\n"
+            f"Error: {escape_markdown(str(e))}",
+            reply_markup=_MARKUP_BACK_CONFIG,
+            parse_mode='MarkdownV2'
+        )
+
+async def _h_menu_stats(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                        arg: Optional[str], is_owner: bool) -> None:
+    """Show connection statistics"""
+    await safe_edit(
+        query, context,
+        await asyncio.to_thread(MessageFormatter.format_connection_stats),
+        reply_markup=_MARKUP_STATS,
+        parse_mode='MarkdownV2'
+    )
+
+async def _h_client_list(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                         arg: Optional[str], is_owner: bool) -> None:
+    """Show the client list"""
+    clients = await asyncio.to_thread(wg_manager.list_clients)
+    await safe_edit(
+        query, context,
+        MessageFormatter.format_client_list(clients),
+        reply_markup=_MARKUP_CLIENT_LIST,
+        parse_mode='MarkdownV2'
+    )
+
+async def _h_client_select(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                           arg: Optional[str], is_owner: bool) -> None:
+    """Ask which client to remove, show a QR code for, or get config for"""
+    clients = await _cached_clients(context)
+    if not clients:
+        await safe_edit(
+            query, context,
+            "❌ No clients found\\.",
+            reply_markup=_MARKUP_BACK_CLIENTS,
+            parse_mode='MarkdownV2'
+        )
+        return
+    
+    action = query.data.split('_')[1]
+    action_text = {
+        'remove': 'remove',
+        'qr': 'show QR code for',
+        'config': 'get config for'
+    }[action]
+    
+    await safe_edit(
+        query, context,
+        f"Select a client to {action_text}:",
+        reply_markup=MenuHandler.create_client_selection_menu(clients, action),
+        parse_mode='MarkdownV2'
+    )
+
+async def _h_client_qr(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                       arg: Optional[str], is_owner: bool) -> None:
+    """Generate and send a client QR code"""
+    client_name = arg
+    escaped_name = escape_markdown(client_name)
+    
+    await safe_edit(
+        query, context,
+        f"📱 Generating QR code for {escaped_name}\\.\\.\\.",
+        parse_mode='MarkdownV2'
+    )
+    
+    success, message, qr_image_path = await asyncio.to_thread(wg_manager.get_client_qr, client_name)
+    
+    if success and qr_image_path:
+        try:
+            # Use robust sending method
+            send_success, send_message = await send_qr_image_robust(
+                context.bot, query.message.chat_id, qr_image_path, client_name
             )
             
-            success, message = wg_manager.remove_client(client_name)
-            
-            if success:
-                await query.edit_message_text(
-                    f"✅ {escape_markdown(message)}",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back to Clients", callback_data="menu_clients")
-                    ]]),
+            if send_success:
+                await safe_edit(
+                    query, context,
+                    f"✅ QR code sent for {escaped_name}\\!\n\n"
+                    f"📱 {escape_markdown(send_message)}",
+                    reply_markup=_MARKUP_BACK_CLIENTS,
                     parse_mode='MarkdownV2'
                 )
             else:
-                await query.edit_message_text(
-                    f"❌ {escape_markdown(message)}",
+                await safe_edit(
+                    query, context,
+                    f"⚠️ QR code generated but failed to send\\.\n\n"
+                    f"Error: {escape_markdown(send_message)}\n\n"
+                    f"You can still get the config file to import manually\\.",
                     reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back to Clients", callback_data="menu_clients")
+                        InlineKeyboardButton("🔄 Try Again", callback_data=f"client_qr_{client_name}"),
+                        InlineKeyboardButton("📄 Get Config Instead", callback_data=f"client_config_{client_name}"),
+                        _BTN_BACK_CLIENTS
                     ]]),
                     parse_mode='MarkdownV2'
                 )
-        
-        elif callback_data == "client_add":
-            # Check if WireGuard is installed
-            if not wg_manager.is_installed():
-                await query.edit_message_text(
-                    "❌ *WireGuard Not Installed*\n\n"
-                    "WireGuard must be installed before adding clients\\.\n"
-                    "Use `/install` command to set up WireGuard first\\.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back", callback_data="menu_clients")
-                    ]]),
+        finally:
+            # Clean up temporary file
+            discard_temp_file(qr_image_path)
+    else:
+        await safe_edit(
+            query, context,
+            f"❌ QR Code Error: {escape_markdown(message)}\n\n"
+            f"You can still download the config file and import it manually\\.",
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton("📄 Get Config File", callback_data=f"client_config_{client_name}"),
+                _BTN_BACK_CLIENTS
+            ]]),
+            parse_mode='MarkdownV2'
+        )
+
+async def _h_client_config(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                           arg: Optional[str], is_owner: bool) -> None:
+    """Send a client config file and its content"""
+    client_name = arg
+    success, message, config_content = await asyncio.to_thread(wg_manager.get_client_config, client_name)
+    
+    if success and config_content:
+        chat_id = query.message.chat_id
+        escaped_name = escape_markdown(client_name)
+        
+        async def send_content() -> None:
+            """Send config content in code format, parts in order"""
+            # Split long configs to avoid Telegram message limits
+            max_length = 3500  # Leave room for formatting
+            if len(config_content) > max_length:
+                # Slice each chunk as it is sent rather than building the list up front
+                n_chunks = -(-len(config_content) // max_length)
+                for i in range(n_chunks):
+                    chunk = config_content[i * max_length:(i + 1) * max_length]
+                    text = f"📄 *Config Content for {escaped_name} \\(Part {i+1}/{n_chunks}\\)*\n\n```\n{chunk}\n```"
+                    await rate_limiter.call(lambda: context.bot.send_message(
+                        chat_id=chat_id,
+                        text=text,
+                        parse_mode='MarkdownV2'
+                    ), chat_id)
+            else:
+                await rate_limiter.call(lambda: context.bot.send_message(
+                    chat_id=chat_id,
+                    text=f"📄 *Config Content for {escaped_name}*\n\n```\n{config_content}\n```",
                     parse_mode='MarkdownV2'
-                )
-                return
-            
-            # Start the add client process
-            await query.edit_message_text(
-                "➕ *Add New Client*\n\n"
-                "Please enter a name for the new client:\n"
-                "\\(Only letters, numbers, hyphens, and underscores allowed\\)\n\n"
-                "💡 *Tip:* Use descriptive names like 'john\\-phone' or 'laptop\\-work'",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("❌ Cancel", callback_data="menu_clients")
-                ]]),
-                parse_mode='MarkdownV2'
-            )
-            
-            # Store the state for this user
-            context.user_data['menu_state'] = 'waiting_client_name'
-            context.user_data['original_message_id'] = query.message.message_id
-        
-        elif callback_data == "menu_backup":
-            await query.edit_message_text(
-                "💾 *Backup & Restore*\n\nChoose an action:",
-                reply_markup=InlineKeyboardMarkup([
-                    [
-                        InlineKeyboardButton("📦 Create Backup", callback_data="backup_create"),
-                        InlineKeyboardButton("📊 Backup Info", callback_data="backup_info")
-                    ],
-                    [InlineKeyboardButton("⬅️ Back to Main", callback_data="menu_main")]
-                ]),
-                parse_mode='MarkdownV2'
-            )
-        
-        elif callback_data == "backup_create":
-            await query.edit_message_text(
-                "📦 Creating backup\\.\\.\\.",
-                parse_mode='MarkdownV2'
-            )
-            
-            success, message, backup_file = wg_manager.backup_configs()
-            
-            if success and backup_file:
-                try:
-                    # Verify file exists and has content
-                    if not os.path.exists(backup_file):
-                        raise FileNotFoundError(f"Backup file not found: {backup_file}")
-                    
-                    file_size = os.path.getsize(backup_file)
-                    if file_size == 0:
-                        raise ValueError("Backup file is empty")
-                    
-                    filename = os.path.basename(backup_file)
-                    
-                    # Send backup file with proper file handling
-                    with open(backup_file, 'rb') as f:
-                        await context.bot.send_document(
-                            chat_id=query.message.chat_id,
-                            document=f,
-                            filename=filename,
-                            caption=f"💾 {escape_markdown(message)}\n\n📏 Size: {format_file_size(file_size)}"
-                        )
-                    
-                    await query.edit_message_text(
-                        f"✅ Backup created and sent successfully\\!\n\n"
-                        f"📄 File: {escape_markdown(filename)}\n"
-                        f"📏 Size: {escape_markdown(format_file_size(file_size))}",
-                        reply_markup=InlineKeyboardMarkup([[
-                            InlineKeyboardButton("📦 Create Another", callback_data="backup_create"),
-                            InlineKeyboardButton("⬅️ Back", callback_data="menu_backup")
-                        ]]),
-                        parse_mode='MarkdownV2'
-                    )
-                    
-                    # Clean up backup file after sending
-                    try:
-                        import os as os_module  # Explicit import to avoid any scoping issues
-                        os_module.unlink(backup_file)
-                        logger.info(f"Backup file cleaned up: {backup_file}")
-                    except Exception as cleanup_error:
-                        logger.warning(f"Failed to cleanup backup file: {cleanup_error}")
-                        
-                except Exception as send_error:
-                    logger.error(f"Error sending backup file: {send_error}")
-                    await query.edit_message_text(
-                        f"❌ Backup created but failed to send\\.\n\n"
-                        f"Error: {escape_markdown(str(send_error))}\n"
-                        f"File location: {escape_markdown(backup_file)}",
-                        reply_markup=InlineKeyboardMarkup([[
-                            InlineKeyboardButton("🔄 Try Again", callback_data="backup_create"),
-                            InlineKeyboardButton("⬅️ Back", callback_data="menu_backup")
-                        ]]),
-                        parse_mode='MarkdownV2'
-                    )
-            else:
-                await query.edit_message_text(
-                    f"❌ Backup creation failed\\.\n\n"
-                    f"Error: {escape_markdown(message)}",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("🔄 Try Again", callback_data="backup_create"),
-                        InlineKeyboardButton("⬅️ Back", callback_data="menu_backup")
-                    ]]),
-                    parse_mode='MarkdownV2'
-                )
-        
-        elif callback_data == "backup_info":
-            # Show backup information
-            try:
-                # Get system info for backup details
-                status = wg_manager.get_server_status()
-                clients = wg_manager.list_clients()
-                
-                # Calculate estimated backup size
-                total_configs = 1 + len(clients)  # server config + client configs
-                estimated_size = total_configs * 2  # Rough estimate in KB
-                
-                info_message = (
-                    f"📊 *Backup Information*\n\n"
-                    f"📄 *What gets backed up:*\n"
-                    f"• Server configuration \\(wg0\\.conf\\)\n"
-                    f"• All client configurations \\({len(clients)} files\\)\n"
-                    f"• Configuration metadata\n\n"
-                    f"📦 *Backup Details:*\n"
-                    f"• Format: tar\\.gz compressed archive\n"
-                    f"• Total files: {total_configs}\n"
-                    f"• Estimated size: ~{estimated_size}KB\n\n"
-                    f"🔒 *Security:*\n"
-                    f"• Contains private keys and sensitive data\n"
-                    f"• Store backup files securely\n"
-                    f"• Delete after downloading if not needed\n\n"
-                    f"💡 *Usage:*\n"
-                    f"• Extract with: `tar -xzf backup_file.tar.gz`\n"
-                    f"• Server config in root, clients in /clients/ folder"
-                )
-                
-                await query.edit_message_text(
-                    info_message,
-                    reply_markup=InlineKeyboardMarkup([
-                        [
-                            InlineKeyboardButton("📦 Create Backup", callback_data="backup_create"),
-                            InlineKeyboardButton("⬅️ Back", callback_data="menu_backup")
-                        ]
-                    ]),
-                    parse_mode='MarkdownV2'
-                )
-            except Exception as e:
-                logger.error(f"Error showing backup info: {e}")
-                await query.edit_message_text(
-                    f"❌ Error loading backup information\\.\n\n"
-                    f"Error: {escape_markdown(str(e))}",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back", callback_data="menu_backup")
-                    ]]),
-                    parse_mode='MarkdownV2'
-                )
+                ), chat_id)
         
-        elif callback_data == "users_list":
-            is_owner = config.is_owner(user_id)
-            if not is_owner:
-                await query.edit_message_text(
-                    "❌ Access denied\\.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back", callback_data="menu_users")
-                    ]]),
-                    parse_mode='MarkdownV2'
-                )
-                return
-            
-            authorized_users = config.get('authorized_users', [])
-            owner_id = config.get('owner_id')
-            
-            message = "👥 *Authorized Users*\n\n"
-            for i, uid in enumerate(authorized_users, 1):
-                role = " \\(Owner\\)" if uid == owner_id else ""
-                username = config.get_user_username(uid)
-                
-                if username:
-                    display_name = f"@{escape_markdown(username)} \\(`{uid}`\\)"
-                else:
-                    display_name = f"`{uid}`"
-                
-                message += f"{i}\\. {display_name}{role}\n"
-            
-            await query.edit_message_text(
-                message,
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("⬅️ Back", callback_data="menu_users")
-                ]]),
-                parse_mode='MarkdownV2'
-            )
-        
-        elif callback_data == "users_add":
-            is_owner = config.is_owner(user_id)
-            if not is_owner:
-                await query.edit_message_text(
-                    "❌ Access denied\\.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back", callback_data="menu_users")
-                    ]]),
-                    parse_mode='MarkdownV2'
-                )
-                return
-            
-            # Start menu-driven user addition
-            context.user_data['menu_state'] = 'waiting_user_id'
-            context.user_data['user_action'] = 'add'
-            
-            await query.edit_message_text(
-                "➕ *Add New User*\n\n"
-                "Please send the Telegram User ID or Username of the user you want to authorize\\.\n\n"
-                "💡 *Accepted Formats:*\n"
-                "• User ID: `your_user_id`\n"
-                "• Username: `@username` or `username`\n\n"
-                "🔍 *How to find User ID:*\n"
-                "• Forward a message from the user to @userinfobot\n"
-                "• Or ask the user to send `/start` to @userinfobot\n\n"
-                "📝 *Send either format:*",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("❌ Cancel", callback_data="menu_users")
-                ]]),
-                parse_mode='MarkdownV2'
-            )
-        
-        elif callback_data == "users_limits":
-            is_owner = config.is_owner(user_id)
-            if not is_owner:
-                await query.edit_message_text(
-                    "❌ Access denied\\.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back", callback_data="menu_users")
-                    ]]),
-                    parse_mode='MarkdownV2'
-                )
-                return
-            
-            await query.edit_message_text(
-                "⚙️ *User Limits Management*\n\n"
-                "Configure user permissions and limits:",
-                reply_markup=MenuHandler.create_user_limits_menu(),
-                parse_mode='MarkdownV2'
-            )
-        
-        elif callback_data == "limits_set_user":
-            is_owner = config.is_owner(user_id)
-            if not is_owner:
-                await query.edit_message_text(
-                    "❌ Access denied\\.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back", callback_data="users_limits")
-                    ]]),
-                    parse_mode='MarkdownV2'
-                )
-                return
-            
-            # Show list of users to select for limit setting
-            users_info = config.get_all_users_with_limits()
-            non_owner_users = [u for u in users_info if not u['is_owner']]
-            
-            if not non_owner_users:
-                await query.edit_message_text(
-                    "ℹ️ *No Users to Configure*\n\n"
-                    "There are no non\\-owner users to set limits for\\.\n"
-                    "Add some users first\\.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("➕ Add User", callback_data="users_add"),
-                        InlineKeyboardButton("⬅️ Back", callback_data="users_limits")
-                    ]]),
-                    parse_mode='MarkdownV2'
-                )
-                return
-            
-            keyboard = []
-            for user_info in non_owner_users[:10]:  # Limit to 10 users for UI
-                uid = user_info['user_id']
-                user_id_str = str(uid)
-                username = config.get_user_username(uid)
-                
-                if username:
-                    button_text = f"👤 @{username}"
-                else:
-                    button_text = f"👤 {user_id_str}"
-                
-                keyboard.append([
-                    InlineKeyboardButton(button_text, callback_data=f"limits_user_{user_id_str}")
-                ])
-            
-            keyboard.append([
-                InlineKeyboardButton("⬅️ Back", callback_data="users_limits")
-            ])
-            
-            await query.edit_message_text(
-                "👤 *Select User to Configure*\n\n"
-                "Choose a user to set limits for:",
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode='MarkdownV2'
-            )
+        # Upload the config file while the content messages go out
+        await asyncio.gather(
+            rate_limiter.call(lambda: context.bot.send_document(
+                chat_id=chat_id,
+                document=InputFile(config_content.encode(), filename=f"{client_name}.conf"),
+                caption=f"📄 Configuration file for {client_name}"
+            ), chat_id),
+            send_content()
+        )
         
-        elif callback_data.startswith("limits_user_"):
-            is_owner = config.is_owner(user_id)
-            if not is_owner:
-                await query.edit_message_text(
-                    "❌ Access denied\\.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back", callback_data="users_limits")
-                    ]]),
-                    parse_mode='MarkdownV2'
-                )
-                return
-            
-            target_user_id = int(callback_data[12:])  # Remove "limits_user_" prefix
-            limits = config.get_user_limits(target_user_id)
-            
-            # Format current limits
-            max_clients = "Unlimited" if limits['max_clients'] == -1 else str(limits['max_clients'])
-            rate_limit = "Unlimited" if limits['rate_limit'] == -1 else str(limits['rate_limit'])
-            
-            message = (
-                f"⚙️ *User Limits: {escape_markdown(str(target_user_id))}*\n\n"
-                f"📊 *Current Limits:*\n"
-                f"• Max Clients: {escape_markdown(max_clients)}\n"
-                f"• Rate Limit: {escape_markdown(rate_limit)}/min\n"
-                f"• Can Backup: {'✅' if limits['can_backup'] else '❌'}\n"
-                f"• Can View Stats: {'✅' if limits['can_view_stats'] else '❌'}\n"
-                f"• Can Manage Clients: {'✅' if limits['can_manage_clients'] else '❌'}\n\n"
-                f"🔧 *Configure:*"
-            )
-            
-            keyboard = [
-                [
-                    InlineKeyboardButton("📊 Max Clients", callback_data=f"set_max_clients_{target_user_id}"),
-                    InlineKeyboardButton("⏱️ Rate Limit", callback_data=f"set_rate_limit_{target_user_id}")
-                ],
-                [
-                    InlineKeyboardButton("💾 Backup Access", callback_data=f"toggle_backup_{target_user_id}"),
-                    InlineKeyboardButton("📈 Stats Access", callback_data=f"toggle_stats_{target_user_id}")
-                ],
-                [
-                    InlineKeyboardButton("👥 Client Management", callback_data=f"toggle_clients_{target_user_id}")
-                ],
-                [
-                    InlineKeyboardButton("🔄 Reset to Default", callback_data=f"reset_limits_{target_user_id}"),
-                    InlineKeyboardButton("⬅️ Back", callback_data="limits_set_user")
-                ]
+        await safe_edit(
+            query, context,
+            f"✅ Config file and content sent for {escaped_name}",
+            reply_markup=_MARKUP_BACK_CLIENTS,
+            parse_mode='MarkdownV2'
+        )
+    else:
+        await safe_edit(
+            query, context,
+            f"❌ {escape_markdown(message)}",
+            reply_markup=_MARKUP_BACK_CLIENTS,
+            parse_mode='MarkdownV2'
+        )
+
+async def _h_client_remove(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                           arg: Optional[str], is_owner: bool) -> None:
+    """Ask for confirmation before removing a client"""
+    client_name = arg
+    
+    # Show confirmation dialog
+    await safe_edit(
+        query, context,
+        f"🗑️ *Remove Client*\n\n"
+        f"Are you sure you want to remove client '{escape_markdown(client_name)}'?\n\n"
+        f"⚠️ This action cannot be undone\\!",
+        reply_markup=InlineKeyboardMarkup([
+            [
+                InlineKeyboardButton("✅ Yes, Remove", callback_data=f"confirm_remove_{client_name}"),
+                InlineKeyboardButton("❌ Cancel", callback_data="menu_clients")
             ]
+        ]),
+        parse_mode='MarkdownV2'
+    )
+
+async def _h_confirm_remove(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                            arg: Optional[str], is_owner: bool) -> None:
+    """Remove a client after confirmation"""
+    client_name = arg
+    
+    await safe_edit(
+        query, context,
+        f"🗑️ Removing client '{escape_markdown(client_name)}'\\.\\.\\.",
+        parse_mode='MarkdownV2'
+    )
+    
+    success, message = await asyncio.to_thread(wg_manager.remove_client, client_name)
+    context.user_data.pop('clients', None)
+    
+    if success:
+        await safe_edit(
+            query, context,
+            f"✅ {escape_markdown(message)}",
+            reply_markup=_MARKUP_BACK_TO_CLIENTS,
+            parse_mode='MarkdownV2'
+        )
+    else:
+        await safe_edit(
+            query, context,
+            f"❌ {escape_markdown(message)}",
+            reply_markup=_MARKUP_BACK_TO_CLIENTS,
+            parse_mode='MarkdownV2'
+        )
+
+async def _h_client_add(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                        arg: Optional[str], is_owner: bool) -> None:
+    """Start the add client flow"""
+    # Check if WireGuard is installed
+    if not wg_manager.is_installed():
+        await safe_edit(
+            query, context,
+            "❌ *WireGuard Not Installed*\n\n"
+            "WireGuard must be installed before adding clients\\.\n"
+            "Use `/install` command to set up WireGuard first\\.",
+            reply_markup=_MARKUP_BACK_CLIENTS,
+            parse_mode='MarkdownV2'
+        )
+        return
+    
+    # Start the add client process
+    await safe_edit(
+        query, context,
+        "➕ *Add New Client*\n\n"
+        "Please enter a name for the new client:\n"
+        "\\(Only letters, numbers, hyphens, and underscores allowed\\)\n\n"
+        "💡 *Tip:* Use descriptive names like 'john\\-phone' or 'laptop\\-work'",
+        reply_markup=_MARKUP_CANCEL_CLIENTS,
+        parse_mode='MarkdownV2'
+    )
+    
+    # Store the state for this user
+    context.user_data['menu_state'] = 'waiting_client_name'
+    context.user_data['original_message_id'] = query.message.message_id
+
+async def _h_menu_backup(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                         arg: Optional[str], is_owner: bool) -> None:
+    """Show the backup menu"""
+    await safe_edit(
+        query, context,
+        "💾 *Backup & Restore*\n\nChoose an action:",
+        reply_markup=_MARKUP_BACKUP_ROOT,
+        parse_mode='MarkdownV2'
+    )
+
+async def _h_backup_create(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                           arg: Optional[str], is_owner: bool) -> None:
+    """Create and send a configuration backup"""
+    await safe_edit(
+        query, context,
+        "📦 Creating backup\\.\\.\\.",
+        parse_mode='MarkdownV2'
+    )
+    
+    # Build the archive in memory; nothing is written to or cleaned up from disk
+    success, message, filename, backup_data = await asyncio.to_thread(wg_manager.backup_configs_bytes)
+    
+    if success and backup_data:
+        try:
+            file_size = len(backup_data)
             
-            await query.edit_message_text(
-                message,
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode='MarkdownV2'
-            )
-        
-        elif callback_data == "limits_view_all":
-            is_owner = config.is_owner(user_id)
-            if not is_owner:
-                await query.edit_message_text(
-                    "❌ Access denied\\.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back", callback_data="users_limits")
-                    ]]),
-                    parse_mode='MarkdownV2'
-                )
-                return
-            
-            users_info = config.get_all_users_with_limits()
-            
-            message = "📋 *All User Limits*\n\n"
-            
-            for user_info in users_info:
-                uid = user_info['user_id']
-                limits = user_info['limits']
-                is_owner_user = user_info['is_owner']
-                
-                role = " \\(Owner\\)" if is_owner_user else ""
-                username = config.get_user_username(uid)
-                
-                if username:
-                    display_name = f"@{escape_markdown(username)} \\(`{uid}`\\)"
-                else:
-                    display_name = f"`{uid}`"
-                
-                max_clients = "∞" if limits['max_clients'] == -1 else str(limits['max_clients'])
-                rate_limit = "∞" if limits['rate_limit'] == -1 else str(limits['rate_limit'])
-                
-                message += (
-                    f"👤 {display_name}{role}\n"
-                    f"  • Clients: {escape_markdown(max_clients)}\n"
-                    f"  • Rate: {escape_markdown(rate_limit)}/min\n"
-                    f"  • Backup: {'✅' if limits['can_backup'] else '❌'}\n\n"
-                )
-            
-            await query.edit_message_text(
-                message,
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("⚙️ Manage Limits", callback_data="limits_set_user"),
-                    InlineKeyboardButton("⬅️ Back", callback_data="users_limits")
-                ]]),
-                parse_mode='MarkdownV2'
-            )
-        
-        elif callback_data.startswith("set_max_clients_"):
-            is_owner = config.is_owner(user_id)
-            if not is_owner:
-                await query.edit_message_text(
-                    "❌ Access denied\\.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back", callback_data="users_limits")
-                    ]]),
-                    parse_mode='MarkdownV2'
-                )
-                return
-            
-            target_user_id = int(callback_data[16:])  # Remove "set_max_clients_" prefix
-            context.user_data['menu_state'] = 'waiting_max_clients'
-            context.user_data['target_user_id'] = target_user_id
+            chat_id = query.message.chat_id
+            await rate_limiter.call(lambda: context.bot.send_document(
+                chat_id=chat_id,
+                document=InputFile(backup_data, filename=filename),
+                caption=f"💾 {escape_markdown(message)}\n\n📏 Size: {format_file_size(file_size)}"
+            ), chat_id)
             
-            await query.edit_message_text(
-                f"📊 *Set Max Clients for User {escape_markdown(str(target_user_id))}*\n\n"
-                f"Enter the maximum number of clients this user can create\\.\n\n"
-                f"💡 *Options:*\n"
-                f"• Enter a number \\(e\\.g\\. `5`, `10`, `50`\\)\n"
-                f"• Enter `unlimited` for no limit\n\n"
-                f"📝 *Send your choice:*",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("❌ Cancel", callback_data=f"limits_user_{target_user_id}")
-                ]]),
+            await safe_edit(
+                query, context,
+                f"✅ Backup created and sent successfully\\!\n\n"
+                f"📄 File: {escape_markdown(filename)}\n"
+                f"📏 Size: {escape_markdown(format_file_size(file_size))}",
+                reply_markup=_MARKUP_BACKUP_DONE,
                 parse_mode='MarkdownV2'
             )
-        
-        elif callback_data.startswith("set_rate_limit_"):
-            is_owner = config.is_owner(user_id)
-            if not is_owner:
-                await query.edit_message_text(
-                    "❌ Access denied\\.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back", callback_data="users_limits")
-                    ]]),
-                    parse_mode='MarkdownV2'
-                )
-                return
-            
-            target_user_id = int(callback_data[15:])  # Remove "set_rate_limit_" prefix
-            context.user_data['menu_state'] = 'waiting_rate_limit'
-            context.user_data['target_user_id'] = target_user_id
-            
-            await query.edit_message_text(
-                f"⏱️ *Set Rate Limit for User {escape_markdown(str(target_user_id))}*\n\n"
-                f"Enter the maximum requests per minute for this user\\.\n\n"
-                f"💡 *Options:*\n"
-                f"• Enter a number \\(e\\.g\\. `10`, `50`, `100`\\)\n"
-                f"• Enter `unlimited` for no limit\n\n"
-                f"📝 *Send your choice:*",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("❌ Cancel", callback_data=f"limits_user_{target_user_id}")
-                ]]),
+                
+        except Exception as send_error:
+            logger.error(f"Error sending backup file: {send_error}")
+            await safe_edit(
+                query, context,
+                f"❌ Backup created but failed to send\\.\n\n"
+                f"Error: {escape_markdown(str(send_error))}",
+                reply_markup=_MARKUP_RETRY_BACKUP,
                 parse_mode='MarkdownV2'
             )
+    else:
+        await safe_edit(
+            query, context,
+            f"❌ Backup creation failed\\.\n\n"
+            f"Error: {escape_markdown(message)}",
+            reply_markup=_MARKUP_RETRY_BACKUP,
+            parse_mode='MarkdownV2'
+        )
+
+def _format_backup_info(client_count: int) -> str:
+    """Format the backup information message"""
+    # Calculate estimated backup size
+    total_configs = 1 + client_count  # server config + client configs
+    estimated_size = total_configs * 2  # Rough estimate in KB
+    
+    return (
+        f"📊 *Backup Information*\n\n"
+        f"📄 *What gets backed up:*\n"
+        f"• Server configuration \\(wg0\\.conf\\)\n"
+        f"• All client configurations \\({client_count} files\\)\n"
+        f"• Configuration metadata\n\n"
+        f"📦 *Backup Details:*\n"
+        f"• Format: {escape_markdown(BACKUP_SUFFIX[1:])} compressed archive\n"
+        f"• Total files: {total_configs}\n"
+        f"• Estimated size: ~{estimated_size}KB\n\n"
+        f"🔒 *Security:*\n"
+        f"• Contains private keys and sensitive data\n"
+        f"• Store backup files securely\n"
+        f"• Delete after downloading if not needed\n\n"
+        f"💡 *Usage:*\n"
+        f"• Extract with: `{BACKUP_EXTRACT_CMD} backup_file{BACKUP_SUFFIX}`\n"
+        f"• Server config in root, clients in /clients/ folder"
+    )
+
+async def _h_backup_info(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                         arg: Optional[str], is_owner: bool) -> None:
+    """Show backup information"""
+    global _backup_info_cache
+    
+    # Show backup information
+    try:
+        # The message only depends on the client count, so reuse it until
+        # the server config changes
+        try:
+            conf_mtime = (await asyncio.to_thread(os.stat, wg_manager.wg_conf)).st_mtime_ns
+        except FileNotFoundError:
+            conf_mtime = None
         
-        elif callback_data.startswith("toggle_backup_"):
-            is_owner = config.is_owner(user_id)
-            if not is_owner:
-                await query.edit_message_text(
-                    "❌ Access denied\\.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back", callback_data="users_limits")
-                    ]]),
-                    parse_mode='MarkdownV2'
-                )
-                return
-            
-            target_user_id = int(callback_data[14:])  # Remove "toggle_backup_" prefix
-            current_limits = config.get_user_limits(target_user_id)
-            current_limits['can_backup'] = not current_limits['can_backup']
-            config.set_user_limits(target_user_id, current_limits)
-            
-            status = "enabled" if current_limits['can_backup'] else "disabled"
-            
-            await query.edit_message_text(
-                f"✅ *Backup Access Updated*\n\n"
-                f"Backup access for user `{target_user_id}` is now {escape_markdown(status)}\\.",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("⚙️ Configure More", callback_data=f"limits_user_{target_user_id}"),
-                    InlineKeyboardButton("⬅️ Back", callback_data="limits_set_user")
-                ]]),
-                parse_mode='MarkdownV2'
-            )
+        cached = _backup_info_cache
+        if conf_mtime is not None and cached is not None and cached[0] == conf_mtime:
+            info_message = cached[1]
+        else:
+            clients = await asyncio.to_thread(wg_manager.list_clients)
+            info_message = _format_backup_info(len(clients))
+            _backup_info_cache = (conf_mtime, info_message)
+        
+        await safe_edit(
+            query, context,
+            info_message,
+            reply_markup=_MARKUP_BACKUP_INFO,
+            parse_mode='MarkdownV2'
+        )
+    except Exception as e:
+        logger.error(f"Error showing backup info: {e}")
+        await safe_edit(
+            query, context,
+            f"❌ Error loading backup information\\.\n\n"
+            f"Error: {escape_markdown(str(e))}",
+            reply_markup=_MARKUP_BACK_BACKUP,
+            parse_mode='MarkdownV2'
+        )
+
+@owner_only("menu_users")
+async def _h_users_list(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                        arg: Optional[str], is_owner: bool) -> None:
+    """Show authorized users"""
+    authorized_users = config.get('authorized_users', [])
+    owner_id = config.owner_id
+    
+    usernames = config.get_usernames_bulk(authorized_users)
+    
+    parts = ["👥 *Authorized Users*\n\n"]
+    append = parts.append
+    for i, uid in enumerate(authorized_users, 1):
+        role = " \\(Owner\\)" if uid == owner_id else ""
+        username = usernames[uid]
+        
+        if username:
+            display_name = f"@{escape_markdown(username)} \\(`{uid}`\\)"
+        else:
+            display_name = f"`{uid}`"
         
-        elif callback_data.startswith("toggle_stats_"):
-            is_owner = config.is_owner(user_id)
-            if not is_owner:
-                await query.edit_message_text(
-                    "❌ Access denied\\.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back", callback_data="users_limits")
-                    ]]),
-                    parse_mode='MarkdownV2'
-                )
-                return
-            
-            target_user_id = int(callback_data[13:])  # Remove "toggle_stats_" prefix
-            current_limits = config.get_user_limits(target_user_id)
-            current_limits['can_view_stats'] = not current_limits['can_view_stats']
-            config.set_user_limits(target_user_id, current_limits)
-            
-            status = "enabled" if current_limits['can_view_stats'] else "disabled"
-            
-            await query.edit_message_text(
-                f"✅ *Stats Access Updated*\n\n"
-                f"Stats access for user `{target_user_id}` is now {escape_markdown(status)}\\.",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("⚙️ Configure More", callback_data=f"limits_user_{target_user_id}"),
-                    InlineKeyboardButton("⬅️ Back", callback_data="limits_set_user")
-                ]]),
-                parse_mode='MarkdownV2'
-            )
+        append(f"{i}\\. {display_name}{role}\n")
+    
+    await safe_edit(
+        query, context,
+        ''.join(parts),
+        reply_markup=_MARKUP_BACK_USERS,
+        parse_mode='MarkdownV2'
+    )
+
+@owner_only("menu_users")
+async def _h_users_add(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                       arg: Optional[str], is_owner: bool) -> None:
+    """Start the add user flow"""
+    # Start menu-driven user addition
+    context.user_data['menu_state'] = 'waiting_user_id'
+    context.user_data['user_action'] = 'add'
+    
+    await safe_edit(
+        query, context,
+        "➕ *Add New User*\n\n"
+        "Please send the Telegram User ID or Username of the user you want to authorize\\.\n\n"
+        "💡 *Accepted Formats:*\n"
+        "• User ID: `your_user_id`\n"
+        "• Username: `@username` or `username`\n\n"
+        "🔍 *How to find User ID:*\n"
+        "• Forward a message from the user to @userinfobot\n"
+        "• Or ask the user to send `/start` to @userinfobot\n\n"
+        "📝 *Send either format:*",
+        reply_markup=_MARKUP_CANCEL_USERS,
+        parse_mode='MarkdownV2'
+    )
+
+@owner_only("menu_users")
+async def _h_users_limits(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                          arg: Optional[str], is_owner: bool) -> None:
+    """Show the user limits menu"""
+    await safe_edit(
+        query, context,
+        _USER_LIMITS_MSG,
+        reply_markup=MenuHandler.create_user_limits_menu(),
+        parse_mode='MarkdownV2'
+    )
+
+@owner_only("users_limits")
+async def _h_limits_set_user(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                             arg: Optional[str], is_owner: bool) -> None:
+    """Ask which user to configure limits for, starting at the first page"""
+    await _show_limits_set_user(query, context, *config.list_users_after(None, USERS_PAGE_SIZE))
+
+@owner_only("users_limits")
+async def _h_limits_set_user_after(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                                   arg: Optional[str], is_owner: bool) -> None:
+    """Show the user picker page following the user id in arg"""
+    await _show_limits_set_user(query, context, *config.list_users_after(int(arg), USERS_PAGE_SIZE))
+
+@owner_only("users_limits")
+async def _h_limits_set_user_before(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                                    arg: Optional[str], is_owner: bool) -> None:
+    """Show the user picker page preceding the user id in arg"""
+    await _show_limits_set_user(query, context, *config.list_users_before(int(arg), USERS_PAGE_SIZE))
+
+async def _show_limits_set_user(query, context: ContextTypes.DEFAULT_TYPE, users: List[Dict],
+                                has_prev: bool, has_more: bool) -> None:
+    """
+    Render one page of the limits user picker
+    Prev/Next carry the first/last user id shown as a cursor, so paging
+    never rescans the users before the current page
+    """
+    if not users and not has_prev:
+        await safe_edit(
+            query, context,
+            "ℹ️ *No Users to Configure*\n\n"
+            "There are no non\\-owner users to set limits for\\.\n"
+            "Add some users first\\.",
+            reply_markup=_MARKUP_LIMITS_NO_USERS,
+            parse_mode='MarkdownV2'
+        )
+        return
+    
+    keyboard = []
+    for user_info in users:
+        user_id_str = str(user_info['user_id'])
+        username = user_info['username']
         
-        elif callback_data.startswith("toggle_clients_"):
-            is_owner = config.is_owner(user_id)
-            if not is_owner:
-                await query.edit_message_text(
-                    "❌ Access denied\\.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back", callback_data="users_limits")
-                    ]]),
-                    parse_mode='MarkdownV2'
-                )
-                return
-            
-            target_user_id = int(callback_data[15:])  # Remove "toggle_clients_" prefix
-            current_limits = config.get_user_limits(target_user_id)
-            current_limits['can_manage_clients'] = not current_limits['can_manage_clients']
-            config.set_user_limits(target_user_id, current_limits)
-            
-            status = "enabled" if current_limits['can_manage_clients'] else "disabled"
-            
-            await query.edit_message_text(
-                f"✅ *Client Management Updated*\n\n"
-                f"Client management for user `{target_user_id}` is now {escape_markdown(status)}\\.",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("⚙️ Configure More", callback_data=f"limits_user_{target_user_id}"),
-                    InlineKeyboardButton("⬅️ Back", callback_data="limits_set_user")
-                ]]),
-                parse_mode='MarkdownV2'
-            )
+        if username:
+            button_text = f"👤 @{username}"
+        else:
+            button_text = f"👤 {user_id_str}"
         
-        elif callback_data.startswith("reset_limits_"):
-            is_owner = config.is_owner(user_id)
-            if not is_owner:
-                await query.edit_message_text(
-                    "❌ Access denied\\.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back", callback_data="users_limits")
-                    ]]),
-                    parse_mode='MarkdownV2'
-                )
-                return
-            
-            target_user_id = int(callback_data[13:])  # Remove "reset_limits_" prefix
-            
-            # Reset to default limits
-            default_limits = {
-                'max_clients': config.get('limits.max_clients', 100),
-                'rate_limit': config.get('limits.rate_limit', 10),
-                'can_backup': True,
-                'can_view_stats': True,
-                'can_manage_clients': True
-            }
-            config.set_user_limits(target_user_id, default_limits)
-            
-            await query.edit_message_text(
-                f"✅ *Limits Reset to Default*\n\n"
-                f"User `{target_user_id}` limits have been reset to default values\\.\n\n"
-                f"📊 *Default Limits:*\n"
-                f"• Max Clients: {escape_markdown(str(default_limits['max_clients']))}\n"
-                f"• Rate Limit: {escape_markdown(str(default_limits['rate_limit']))}/min\n"
-                f"• All permissions enabled",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("⚙️ Configure More", callback_data=f"limits_user_{target_user_id}"),
-                    InlineKeyboardButton("⬅️ Back", callback_data="limits_set_user")
-                ]]),
-                parse_mode='MarkdownV2'
-            )
+        keyboard.append([
+            InlineKeyboardButton(button_text, callback_data=f"limits_user_{user_id_str}")
+        ])
+    
+    nav_row = []
+    if has_prev:
+        # An empty page past the end (users removed since the cursor was
+        # issued) has no cursor to page back from, so restart at the first page
+        prev_data = f"limits_set_user_before_{users[0]['user_id']}" if users else "limits_set_user"
+        nav_row.append(InlineKeyboardButton("◀️ Prev", callback_data=prev_data))
+    if has_more and users:
+        nav_row.append(InlineKeyboardButton(
+            "Next ▶️", callback_data=f"limits_set_user_after_{users[-1]['user_id']}"
+        ))
+    if nav_row:
+        keyboard.append(nav_row)
+    keyboard.append([
+        _BTN_BACK_LIMITS
+    ])
+    
+    await safe_edit(
+        query, context,
+        "👤 *Select User to Configure*\n\n"
+        "Choose a user to set limits for:",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode='MarkdownV2'
+    )
+
+@owner_only("users_limits")
+async def _h_limits_user(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                         arg: Optional[str], is_owner: bool) -> None:
+    """Show limit settings for a user"""
+    target_user_id = int(arg)
+    limits = config.get_user_limits(target_user_id)
+    
+    # Format current limits
+    max_clients = "Unlimited" if limits['max_clients'] == -1 else str(limits['max_clients'])
+    rate_limit = "Unlimited" if limits['rate_limit'] == -1 else str(limits['rate_limit'])
+    
+    message = (
+        f"⚙️ *User Limits: {escape_markdown(str(target_user_id))}*\n\n"
+        f"📊 *Current Limits:*\n"
+        f"• Max Clients: {escape_markdown(max_clients)}\n"
+        f"• Rate Limit: {escape_markdown(rate_limit)}/min\n"
+        f"• Can Backup: {'✅' if limits['can_backup'] else '❌'}\n"
+        f"• Can View Stats: {'✅' if limits['can_view_stats'] else '❌'}\n"
+        f"• Can Manage Clients: {'✅' if limits['can_manage_clients'] else '❌'}\n\n"
+        f"🔧 *Configure:*"
+    )
+    
+    await safe_edit(
+        query, context,
+        message,
+        reply_markup=_limits_user_kb(target_user_id),
+        parse_mode='MarkdownV2'
+    )
+
+@owner_only("users_limits")
+async def _h_limits_view_all(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                             arg: Optional[str], is_owner: bool) -> None:
+    """Show limits for all users, one page at a time"""
+    page = int(arg) if arg else 0
+    users, has_more = config.list_users(page * USERS_PAGE_SIZE, USERS_PAGE_SIZE, exclude_owner=False)
+    
+    parts = ["📋 *All User Limits*\n\n"]
+    append = parts.append
+    
+    for user_info in users:
+        uid = user_info['user_id']
+        limits = user_info['limits']
+        is_owner_user = user_info['is_owner']
         
-        elif callback_data == "menu_use_default_dns":
-            # Handle default DNS selection in menu flow
-            if context.user_data.get('menu_state') == 'waiting_dns_servers':
-                context.user_data['dns_servers'] = "8.8.8.8,8.8.4.4"
-                
-                # Create a fake update object for the create_menu_client function
-                class FakeMessage:
-                    def __init__(self, chat_id):
-                        self.chat_id = chat_id
-                        self.message_id = query.message.message_id
-                    
-                    async def reply_text(self, *args, **kwargs):
-                        return await context.bot.send_message(self.chat_id, *args, **kwargs)
-                    
-                    async def reply_document(self, *args, **kwargs):
-                        return await context.bot.send_document(self.chat_id, *args, **kwargs)
-                    
-                    async def reply_photo(self, *args, **kwargs):
-                        return await context.bot.send_photo(self.chat_id, *args, **kwargs)
-                
-                fake_update = type('FakeUpdate', (), {})()
-                fake_update.message = FakeMessage(query.message.chat_id)
-                
-                await create_menu_client(fake_update, context)
-            else:
-                await query.edit_message_text(
-                    "❌ Invalid operation\\.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("⬅️ Back", callback_data="menu_clients")
-                    ]]),
-                    parse_mode='MarkdownV2'
-                )
+        role = " \\(Owner\\)" if is_owner_user else ""
+        username = user_info['username']
         
-        elif callback_data == "menu_help":
-            await query.edit_message_text(
-                MessageFormatter.format_help_message(),
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("⬅️ Back to Main", callback_data="menu_main")
-                ]]),
-                parse_mode='MarkdownV2'
-            )
+        if username:
+            display_name = f"@{escape_markdown(username)} \\(`{uid}`\\)"
+        else:
+            display_name = f"`{uid}`"
         
-        elif callback_data == "menu_users":
-            is_owner = config.is_owner(user_id)
-            await query.edit_message_text(
-                "🔒 *User Management*\n\nChoose an action:",
-                reply_markup=MenuHandler.create_user_menu(is_owner),
-                parse_mode='MarkdownV2'
-            )
+        max_clients = "∞" if limits['max_clients'] == -1 else str(limits['max_clients'])
+        rate_limit = "∞" if limits['rate_limit'] == -1 else str(limits['rate_limit'])
         
-        else:
-            # Handle other callbacks or show error
-            await query.edit_message_text(
-                "❌ Unknown action\\. Please try again\\.",
-                reply_markup=MenuHandler.create_main_menu(),
-                parse_mode='MarkdownV2'
-            )
+        append(
+            f"👤 {display_name}{role}\n"
+            f"  • Clients: {escape_markdown(max_clients)}\n"
+            f"  • Rate: {escape_markdown(rate_limit)}/min\n"
+            f"  • Backup: {'✅' if limits['can_backup'] else '❌'}\n\n"
+        )
     
-    except Exception as e:
-        logger.error(f"Error handling callback {callback_data}: {e}")
-        await query.edit_message_text(
+    nav_row = _page_nav_row("limits_view_all", page, has_more)
+    if nav_row:
+        reply_markup = InlineKeyboardMarkup([nav_row, *_MARKUP_LIMITS_OVERVIEW.inline_keyboard])
+    else:
+        reply_markup = _MARKUP_LIMITS_OVERVIEW
+    
+    await safe_edit(
+        query, context,
+        ''.join(parts),
+        reply_markup=reply_markup,
+        parse_mode='MarkdownV2'
+    )
+
+@owner_only("users_limits")
+async def _h_set_max_clients(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                             arg: Optional[str], is_owner: bool) -> None:
+    """Ask for a new max clients value"""
+    target_user_id = int(arg)
+    context.user_data['menu_state'] = 'waiting_max_clients'
+    context.user_data['target_user_id'] = target_user_id
+    
+    await safe_edit(
+        query, context,
+        _SET_MAX_CLIENTS_TMPL.format(escape_markdown(str(target_user_id))),
+        reply_markup=_cancel_limit_input_kb(target_user_id),
+        parse_mode='MarkdownV2'
+    )
+
+@owner_only("users_limits")
+async def _h_set_rate_limit(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                            arg: Optional[str], is_owner: bool) -> None:
+    """Ask for a new rate limit value"""
+    target_user_id = int(arg)
+    context.user_data['menu_state'] = 'waiting_rate_limit'
+    context.user_data['target_user_id'] = target_user_id
+    
+    await safe_edit(
+        query, context,
+        _SET_RATE_LIMIT_TMPL.format(escape_markdown(str(target_user_id))),
+        reply_markup=_cancel_limit_input_kb(target_user_id),
+        parse_mode='MarkdownV2'
+    )
+
+@owner_only("users_limits")
+async def _h_toggle_backup(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                           arg: Optional[str], is_owner: bool) -> None:
+    """Toggle backup access for a user"""
+    target_user_id = int(arg)
+    enabled = config.toggle_user_limit(target_user_id, 'can_backup')
+    await config.aflush()
+    
+    status = "enabled" if enabled else "disabled"
+    
+    await safe_edit(
+        query, context,
+        f"✅ *Backup Access Updated*\n\n"
+        f"Backup access for user `{target_user_id}` is now {escape_markdown(status)}\\.",
+        reply_markup=_configure_more_kb(target_user_id),
+        parse_mode='MarkdownV2'
+    )
+
+@owner_only("users_limits")
+async def _h_toggle_stats(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                          arg: Optional[str], is_owner: bool) -> None:
+    """Toggle stats access for a user"""
+    target_user_id = int(arg)
+    enabled = config.toggle_user_limit(target_user_id, 'can_view_stats')
+    await config.aflush()
+    
+    status = "enabled" if enabled else "disabled"
+    
+    await safe_edit(
+        query, context,
+        f"✅ *Stats Access Updated*\n\n"
+        f"Stats access for user `{target_user_id}` is now {escape_markdown(status)}\\.",
+        reply_markup=_configure_more_kb(target_user_id),
+        parse_mode='MarkdownV2'
+    )
+
+@owner_only("users_limits")
+async def _h_toggle_clients(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                            arg: Optional[str], is_owner: bool) -> None:
+    """Toggle client management access for a user"""
+    target_user_id = int(arg)
+    enabled = config.toggle_user_limit(target_user_id, 'can_manage_clients')
+    await config.aflush()
+    
+    status = "enabled" if enabled else "disabled"
+    
+    await safe_edit(
+        query, context,
+        f"✅ *Client Management Updated*\n\n"
+        f"Client management for user `{target_user_id}` is now {escape_markdown(status)}\\.",
+        reply_markup=_configure_more_kb(target_user_id),
+        parse_mode='MarkdownV2'
+    )
+
+@owner_only("users_limits")
+async def _h_reset_limits(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                          arg: Optional[str], is_owner: bool) -> None:
+    """Reset a user's limits to defaults"""
+    target_user_id = int(arg)
+    
+    # Reset to default limits; repeated presses find nothing to write
+    default_limits = config.get_default_limits()
+    if config.get_user_limits(target_user_id) != default_limits:
+        config.update_user_limits(target_user_id, **default_limits)
+        await config.aflush()
+    
+    await safe_edit(
+        query, context,
+        f"✅ *Limits Reset to Default*\n\n"
+        f"User `{target_user_id}` limits have been reset to default values\\.\n\n"
+        f"📊 *Default Limits:*\n"
+        f"• Max Clients: {escape_markdown(str(default_limits['max_clients']))}\n"
+        f"• Rate Limit: {escape_markdown(str(default_limits['rate_limit']))}/min\n"
+        f"• All permissions enabled",
+        reply_markup=_configure_more_kb(target_user_id),
+        parse_mode='MarkdownV2'
+    )
+
+async def _h_menu_use_default_dns(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                                  arg: Optional[str], is_owner: bool) -> None:
+    """Create the pending client with default DNS servers"""
+    # Handle default DNS selection in menu flow
+    if context.user_data.get('menu_state') == 'waiting_dns_servers':
+        context.user_data['dns_servers'] = "8.8.8.8,8.8.4.4"
+        await create_menu_client(query.message.chat_id, context)
+    else:
+        await safe_edit(
+            query, context,
+            _INVALID_OP_MSG,
+            reply_markup=_MARKUP_BACK_CLIENTS,
+            parse_mode='MarkdownV2'
+        )
+
+async def _h_menu_help(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                       arg: Optional[str], is_owner: bool) -> None:
+    """Show help"""
+    await safe_edit(
+        query, context,
+        MessageFormatter.format_help_message(),
+        reply_markup=_MARKUP_BACK_MAIN,
+        parse_mode='MarkdownV2'
+    )
+
+async def _h_menu_users(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                        arg: Optional[str], is_owner: bool) -> None:
+    """Show the user management menu"""
+    await safe_edit(
+        query, context,
+        "🔒 *User Management*\n\nChoose an action:",
+        reply_markup=MenuHandler.create_user_menu(is_owner),
+        parse_mode='MarkdownV2'
+    )
+
+async def _h_unknown(update: Update, context: ContextTypes.DEFAULT_TYPE, query,
+                     arg: Optional[str], is_owner: bool) -> None:
+    """Report an unknown action"""
+    # Handle other callbacks or show error
+    await safe_edit(
+        query, context,
+        _UNKNOWN_ACTION_MSG,
+        reply_markup=MenuHandler.create_main_menu(),
+        parse_mode='MarkdownV2'
+    )
+
+# Callback dispatch: exact callback_data matches first, then numeric-suffixed
+# ops, then prefixed ones; the suffix (user id, page or client name) is passed
+# to the handler as arg.
+# Handlers also get is_owner, resolved once per callback by the dispatcher
+_EXACT = {
+    "menu_main": _h_menu_main,
+    "menu_clients": _h_menu_clients,
+    "menu_status": _h_menu_status,
+    "menu_config": _h_menu_config,
+    "config_view": _h_config_view,
+    "menu_stats": _h_menu_stats,
+    "client_list": _h_client_list,
+    "client_remove": _h_client_select,
+    "client_qr": _h_client_select,
+    "client_config": _h_client_select,
+    "client_add": _h_client_add,
+    "menu_backup": _h_menu_backup,
+    "backup_create": _h_backup_create,
+    "backup_info": _h_backup_info,
+    "users_list": _h_users_list,
+    "users_add": _h_users_add,
+    "users_limits": _h_users_limits,
+    "limits_set_user": _h_limits_set_user,
+    "limits_view_all": _h_limits_view_all,
+    "menu_use_default_dns": _h_menu_use_default_dns,
+    "menu_help": _h_menu_help,
+    "menu_users": _h_menu_users,
+    # 🔄 Refresh buttons re-render their view; kept apart from navigation
+    # so only real refreshes are debounced
+    "refresh_main": _h_menu_main,
+    "refresh_status": _h_menu_status,
+    "refresh_config": _h_menu_config,
+    "refresh_stats": _h_menu_stats,
+    "refresh_clients": _h_client_list,
+}
+_REFRESH_CALLBACKS = frozenset(k for k in _EXACT if k.startswith("refresh_"))
+
+_PREFIX = (
+    ("client_qr_", _h_client_qr),
+    ("client_config_", _h_client_config),
+    ("client_remove_", _h_client_remove),
+    ("confirm_remove_", _h_confirm_remove),
+)
+
+# Ops whose suffix is a user id, cursor or page number, matched in one regex scan so
+# a malformed suffix falls through to _h_unknown instead of failing int()
+_NUM_OPS = {
+    "limits_user": _h_limits_user,
+    "limits_set_user_after": _h_limits_set_user_after,
+    "limits_set_user_before": _h_limits_set_user_before,
+    "limits_view_all": _h_limits_view_all,
+    "set_max_clients": _h_set_max_clients,
+    "set_rate_limit": _h_set_rate_limit,
+    "toggle_backup": _h_toggle_backup,
+    "toggle_stats": _h_toggle_stats,
+    "toggle_clients": _h_toggle_clients,
+    "reset_limits": _h_reset_limits,
+}
+_NUM_CB_RE = re.compile(rf"^({'|'.join(_NUM_OPS)})_(\d+)$")
+
+# _PREFIX grouped by leading token, so a lookup only tests prefixes that can match
+_PREFIX_BY_HEAD: Dict[str, tuple] = {}
+for _prefix, _handler in _PREFIX:
+    _head = _prefix.partition('_')[0]
+    _PREFIX_BY_HEAD[_head] = _PREFIX_BY_HEAD.get(_head, ()) + ((_prefix, _handler),)
+del _prefix, _handler, _head
+
+def _refresh_window(context: ContextTypes.DEFAULT_TYPE) -> float:
+    """Debounce window for the view just rendered in this chat"""
+    render = context.chat_data.get('last_render')
+    if render is not None and len(render[1]) <= REFRESH_SMALL_VIEW_CHARS:
+        return REFRESH_DEBOUNCE_SHORT
+    return REFRESH_DEBOUNCE_LONG
+
+def _prune_refresh_debounce(now: float) -> None:
+    """Forget refresh taps whose window has passed"""
+    expired = [key for key, (last, _) in _refresh_debounce.items()
+               if now - last >= REFRESH_DEBOUNCE_LONG]
+    for key in expired:
+        del _refresh_debounce[key]
+
+async def handle_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle all menu callback queries"""
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = update.effective_user.id
+    is_owner = config.is_owner(user_id)
+    
+    # Check authorization
+    if not is_owner and not config.is_authorized(user_id):
+        await safe_edit(
+            query, context,
+            "❌ *Access Denied*\n\nYou are not authorized to use this bot\\.",
+            parse_mode='MarkdownV2'
+        )
+        return
+    
+    callback_data = query.data
+    
+    # Drop repeated refresh taps that arrive within the debounce window
+    refresh_key = None
+    if callback_data in _REFRESH_CALLBACKS:
+        refresh_key = (query.message.chat_id, callback_data)
+        now = time.monotonic()
+        last = _refresh_debounce.get(refresh_key)
+        if last is not None and now - last[0] < last[1]:
+            return
+        _refresh_debounce[refresh_key] = (now, REFRESH_DEBOUNCE_LONG)
+        if len(_refresh_debounce) > _REFRESH_DEBOUNCE_MAX:
+            _prune_refresh_debounce(now)
+    
+    try:
+        handler = _EXACT.get(callback_data)
+        arg = None
+        if handler is None and (m := _NUM_CB_RE.match(callback_data)):
+            handler, arg = _NUM_OPS[m[1]], m[2]
+        if handler is None:
+            for prefix, prefix_handler in _PREFIX_BY_HEAD.get(callback_data.partition('_')[0], ()):
+                if callback_data.startswith(prefix):
+                    handler, arg = prefix_handler, callback_data[len(prefix):]
+                    break
+            else:
+                handler = _h_unknown
+        await handler(update, context, query, arg, is_owner)
+        if refresh_key is not None:
+            _refresh_debounce[refresh_key] = (now, _refresh_window(context))
+    except Exception:
+        logger.exception("Error handling callback %s", callback_data)
+        await safe_edit(
+            query, context,
             "❌ An error occurred\\. Please try again\\.",
             reply_markup=MenuHandler.create_main_menu(),
             parse_mode='MarkdownV2'
@@ -6,6 +6,7 @@ This bypasses the test and starts the bot directly
 import os
 import sys
 import logging
+import importlib.util
 
 # Add current directory to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -14,13 +15,11 @@ def check_requirements():
     """Check basic requirements before starting"""
     print("🔍 Checking requirements...")
     
-    # Check if we can import telegram
-    try:
-        from telegram import Update
-        print("✅ Telegram bot library available")
-    except ImportError:
+    # Check telegram is installed without importing it; main loads it later
+    if importlib.util.find_spec("telegram") is None:
         print("❌ Telegram bot library not found. Run: pip install python-telegram-bot==20.7")
         return False
+    print("✅ Telegram bot library available")
     
     # Check if config exists
     from config import config
@@ -1,85 +1,142 @@
 """
 Telegram utility functions for robust file sending
 """
+import asyncio
+import io
 import logging
 import os
-from typing import Optional, Tuple
-from telegram import Bot, InputFile
-from telegram.error import TelegramError
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+from telegram import Bot, InlineKeyboardMarkup
+from telegram.error import RetryAfter, TelegramError
 
 logger = logging.getLogger(__name__)
 
-async def send_qr_image_robust(bot: Bot, chat_id: int, qr_image_path: str, client_name: str) -> Tuple[bool, str]:
+T = TypeVar('T')
+
+# Bucket count past which idle (fully refilled) buckets are pruned
+_MAX_BUCKETS = 1024
+
+class RateLimiter:
+    """
+    Throttle Bot API calls to stay inside Telegram's flood limits
+    Each chat gets a token bucket (short bursts, then `rate` calls per second),
+    a semaphore bounds calls in flight globally, and a RetryAfter response is
+    waited out and retried once
+    """
+    
+    def __init__(self, rate: float = 1.0, burst: int = 3, max_concurrent: int = 28):
+        self.rate = rate
+        self.burst = burst
+        self._global_sem = asyncio.Semaphore(max_concurrent)
+        # chat_id -> (tokens, updated_at); tokens go negative while calls queue
+        self._buckets: Dict[int, Tuple[float, float]] = {}
+    
+    def _prune(self, now: float) -> None:
+        """Drop buckets that have refilled to burst, same as a fresh bucket"""
+        full = [
+            chat_id for chat_id, (tokens, updated_at) in self._buckets.items()
+            if tokens + (now - updated_at) * self.rate >= self.burst
+        ]
+        for chat_id in full:
+            del self._buckets[chat_id]
+    
+    async def call(self, coro_factory: Callable[[], Awaitable[T]], chat_id: int) -> T:
+        """Run coro_factory() once the chat's bucket allows it"""
+        now = asyncio.get_running_loop().time()
+        if len(self._buckets) >= _MAX_BUCKETS:
+            self._prune(now)
+        tokens, updated_at = self._buckets.get(chat_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate) - 1
+        self._buckets[chat_id] = (tokens, now)
+        if tokens < 0:
+            await asyncio.sleep(-tokens / self.rate)
+        
+        async with self._global_sem:
+            try:
+                return await coro_factory()
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                logger.warning("Flood limit hit for chat %s, retrying in %ss", chat_id, retry_after)
+        
+        await asyncio.sleep(retry_after)
+        async with self._global_sem:
+            return await coro_factory()
+
+# Shared limiter for all outgoing bot calls
+rate_limiter = RateLimiter()
+
+# Strong references to fire-and-forget tasks so they aren't collected early
+_background_tasks = set()
+
+def _unlink_quietly(path: str) -> None:
+    """Delete a file, ignoring errors"""
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+def discard_temp_file(path: str) -> None:
+    """Delete a temporary file in a worker thread without waiting for it"""
+    task = asyncio.create_task(asyncio.to_thread(_unlink_quietly, path))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def send_qr_image_robust(bot: Bot, chat_id: int, qr_image_path: str, client_name: str,
+                               caption: Optional[str] = None, parse_mode: Optional[str] = None,
+                               reply_markup: Optional[InlineKeyboardMarkup] = None) -> Tuple[bool, str]:
     """
     Robustly send QR code image with multiple fallback methods
+    Caption, parse_mode and reply_markup are applied to whichever method succeeds
     Returns: (success, message)
     """
-    if not os.path.exists(qr_image_path):
+    if caption is None:
+        caption = f"📱 QR Code for {client_name}\n\nScan this with your WireGuard app to connect!"
+    send_options = {'caption': caption, 'parse_mode': parse_mode, 'reply_markup': reply_markup}
+    
+    # Read the image once; every attempt below gets a fresh buffer over it
+    try:
+        with open(qr_image_path, 'rb') as qr_file:
+            data = qr_file.read()
+    except FileNotFoundError:
         return False, "QR image file not found"
     
-    file_size = os.path.getsize(qr_image_path)
-    if file_size == 0:
+    if not data:
         return False, "QR image file is empty"
     
-    caption = f"📱 QR Code for {client_name}\n\nScan this with your WireGuard app to connect!"
-    
-    # Method 1: Send as photo with file object
-    try:
-        with open(qr_image_path, 'rb') as photo_file:
-            await bot.send_photo(
-                chat_id=chat_id,
-                photo=photo_file,
-                caption=caption
-            )
-        logger.info(f"QR code sent as photo for {client_name}")
-        return True, "QR code sent as photo"
-    except TelegramError as e:
-        logger.warning(f"Failed to send QR as photo: {e}")
-    except Exception as e:
-        logger.warning(f"Unexpected error sending QR as photo: {e}")
+    return await _send_qr_bytes(bot, chat_id, data, client_name, send_options)
+
+async def _send_qr_bytes(bot: Bot, chat_id: int, data: bytes, client_name: str,
+                         send_options: Dict) -> Tuple[bool, str]:
+    """Send QR image bytes, trying each fallback method in turn"""
+    filename = f"{client_name}_qr.png"
     
-    # Method 2: Send as photo with InputFile
-    try:
-        await bot.send_photo(
-            chat_id=chat_id,
-            photo=InputFile(qr_image_path, filename=f"{client_name}_qr.png"),
-            caption=caption
-        )
-        logger.info(f"QR code sent as photo (InputFile) for {client_name}")
-        return True, "QR code sent as photo"
-    except TelegramError as e:
-        logger.warning(f"Failed to send QR as photo (InputFile): {e}")
-    except Exception as e:
-        logger.warning(f"Unexpected error sending QR as photo (InputFile): {e}")
+    def buffer() -> io.BytesIO:
+        """Fresh named buffer over the image, so retries never see a consumed stream"""
+        bio = io.BytesIO(data)
+        bio.name = filename
+        return bio
     
-    # Method 3: Send as document
-    try:
-        with open(qr_image_path, 'rb') as doc_file:
-            await bot.send_document(
-                chat_id=chat_id,
-                document=doc_file,
-                filename=f"{client_name}_qr.png",
-                caption=caption
+    # Photo first for an inline preview, then document, which Telegram accepts
+    # for images it refuses as photos. Flood limits are retried by rate_limiter
+    last_error = None
+    for method, kind in ((bot.send_photo, "photo"), (bot.send_document, "document")):
+        file_kwargs = {'filename': filename} if kind == "document" else {}
+        try:
+            await rate_limiter.call(
+                lambda: method(chat_id=chat_id, **{kind: buffer()}, **file_kwargs, **send_options),
+                chat_id
             )
-        logger.info(f"QR code sent as document for {client_name}")
-        return True, "QR code sent as document"
-    except TelegramError as e:
-        logger.warning(f"Failed to send QR as document: {e}")
-    except Exception as e:
-        logger.warning(f"Unexpected error sending QR as document: {e}")
+            logger.info("QR code sent as %s for %s", kind, client_name)
+            return True, f"QR code sent as {kind}"
+        except TelegramError as e:
+            logger.warning("Failed to send QR as %s: %s", kind, e)
+            last_error = e
+        except Exception as e:
+            logger.warning("Unexpected error sending QR as %s: %s", kind, e)
+            last_error = e
     
-    # Method 4: Send as document with InputFile
-    try:
-        await bot.send_document(
-            chat_id=chat_id,
-            document=InputFile(qr_image_path, filename=f"{client_name}_qr.png"),
-            caption=caption
-        )
-        logger.info(f"QR code sent as document (InputFile) for {client_name}")
-        return True, "QR code sent as document"
-    except TelegramError as e:
-        logger.error(f"All methods failed to send QR code. Last error: {e}")
-        return False, f"Failed to send QR code: {str(e)}"
-    except Exception as e:
-        logger.error(f"All methods failed with unexpected error: {e}")
-        return False, f"Unexpected error: {str(e)}"
+    logger.error("All methods failed to send QR code. Last error: %s", last_error)
+    return False, f"Failed to send QR code: {str(last_error)}"
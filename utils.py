@@ -2,19 +2,69 @@
 Utility functions for WireBot
 """
 import os
-import re
 import pwd
+import shutil
+import socket
+import string
+import time
+import functools
 import subprocess
 import logging
-from typing import Optional, List, Tuple
+from typing import Dict, Optional, List, Tuple
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+class _ClientNameTable(dict):
+    """str.translate table keeping allowed characters and mapping any other to '_'"""
+    def __missing__(self, codepoint: int) -> str:
+        return '_'
+
+# Client names keep only alphanumerics, underscore and hyphen
+_CLIENT_NAME_TABLE = _ClientNameTable(
+    (ord(c), c) for c in string.ascii_letters + string.digits + '_-'
+)
+# MarkdownV2 special characters mapped to their escaped form
+_MD_V2_TABLE = str.maketrans({c: '\\' + c for c in '_*[]()~`>#+-=|{}.!'})
+
+_SIZE_UNITS = ("B", "KB", "MB", "GB")
+_SIZE_UNITS_MAX = len(_SIZE_UNITS) - 1
+
+# Seconds system/service probes are reused across status requests
+SYSTEM_INFO_CACHE_TTL = 3
+
+# path -> (mtime_ns, size, contents) for read_file_cached
+_FILE_CACHE: Dict[str, Tuple[int, int, bytes]] = {}
+
+def ttl_cache(seconds: float):
+    """
+    Memoize a function's results for a short time window
+    Results are keyed by call arguments; call .cache_clear() to invalidate
+    """
+    def decorator(func):
+        cache = {}
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items()))) if kwargs else args
+            now = time.monotonic()
+            entry = cache.get(key)
+            if entry is not None and now - entry[0] < seconds:
+                return entry[1]
+            value = func(*args, **kwargs)
+            cache[key] = (now, value)
+            return value
+        
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+@functools.lru_cache(maxsize=1)
 def get_export_directory() -> str:
     """
     Get the correct export directory for WireGuard configs
     Mimics the get_export_dir() function from wireguard.sh
+    Computed once, since SUDO_USER and its home don't change while running
     """
     export_dir = os.path.expanduser("~/")
     
@@ -31,19 +81,48 @@ def get_export_directory() -> str:
     
     return export_dir
 
+def read_file_cached(path: str) -> bytes:
+    """
+    Read a small file, reusing the last contents while its mtime and size are unchanged
+    Raises OSError like open() when the file cannot be read
+    """
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _FILE_CACHE.get(path)
+    if cached is not None and cached[:2] == key:
+        return cached[2]
+    
+    with open(path, 'rb') as f:
+        data = f.read()
+    _FILE_CACHE[path] = (*key, data)
+    return data
+
+@functools.lru_cache(maxsize=1)
+def _config_search_paths() -> Tuple[str, ...]:
+    """Directories searched for client configs, in priority order (computed once)"""
+    return (
+        get_export_directory(),
+        "/root/",
+        "/home/shair/",
+        os.path.expanduser("~/"),
+        "/tmp/",
+        "/etc/wireguard/clients/"
+    )
+
+def advise_sequential(f) -> None:
+    """Hint the kernel that an open file will be read front to back"""
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
 def find_config_file(client_name: str, search_paths: Optional[List[str]] = None) -> Optional[str]:
     """
     Find a WireGuard config file in multiple possible locations
     """
     if search_paths is None:
-        search_paths = [
-            get_export_directory(),
-            "/root/",
-            "/home/shair/",
-            os.path.expanduser("~/"),
-            "/tmp/",
-            "/etc/wireguard/clients/"
-        ]
+        search_paths = _config_search_paths()
     
     filename = f"{client_name}.conf"
     
@@ -56,21 +135,44 @@ def find_config_file(client_name: str, search_paths: Optional[List[str]] = None)
     logger.warning(f"Config file {filename} not found in any search paths")
     return None
 
+def index_config_files(search_paths: Optional[List[str]] = None) -> Dict[str, str]:
+    """
+    Map each .conf filename in the search paths to its full path
+    One directory scan per path replaces an exists() check per client;
+    earlier paths win, matching find_config_file
+    """
+    if search_paths is None:
+        search_paths = _config_search_paths()
+    
+    index = {}
+    for path in search_paths:
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.conf') and entry.name not in index and entry.is_file():
+                        index[entry.name] = entry.path
+        except OSError:
+            continue
+    return index
+
 def sanitize_client_name(name: str) -> str:
     """
     Sanitize client name according to WireGuard requirements
     """
+    # Limit to 15 characters first; the mapping below is one-to-one
     # Allow only alphanumeric, underscore, and hyphen
-    sanitized = re.sub(r'[^0-9a-zA-Z_-]', '_', name)
-    # Limit to 15 characters
-    return sanitized[:15]
+    return name[:15].translate(_CLIENT_NAME_TABLE)
 
 def validate_ip_address(ip: str) -> bool:
     """
     Validate IPv4 address format
     """
-    pattern = r'^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])$'
-    return bool(re.match(pattern, ip))
+    # inet_aton also takes short, octal and hex forms; requiring the address
+    # to round-trip unchanged keeps only canonical dotted quads
+    try:
+        return socket.inet_ntoa(socket.inet_aton(ip)) == ip
+    except (OSError, ValueError):
+        return False
 
 def validate_dns_servers(dns_string: str) -> bool:
     """
@@ -79,8 +181,12 @@ def validate_dns_servers(dns_string: str) -> bool:
     if not dns_string or not dns_string.strip():
         return False
     
-    dns_servers = [ip.strip() for ip in dns_string.split(',')]
-    return all(validate_ip_address(ip) for ip in dns_servers if ip.strip())
+    # Stop at the first bad entry; empty entries are skipped as before
+    for part in dns_string.split(','):
+        ip = part.strip()
+        if ip and not validate_ip_address(ip):
+            return False
+    return True
 
 def format_file_size(size_bytes: int) -> str:
     """
@@ -89,13 +195,11 @@ def format_file_size(size_bytes: int) -> str:
     if size_bytes == 0:
         return "0 B"
     
-    size_names = ["B", "KB", "MB", "GB"]
-    i = 0
-    while size_bytes >= 1024 and i < len(size_names) - 1:
-        size_bytes /= 1024.0
-        i += 1
+    # Each unit is 10 more bits, so the bit length picks it without a loop
+    whole = int(size_bytes)
+    i = min((whole.bit_length() - 1) // 10, _SIZE_UNITS_MAX) if whole > 0 else 0
     
-    return f"{size_bytes:.1f} {size_names[i]}"
+    return f"{size_bytes / (1 << (10 * i)):.1f} {_SIZE_UNITS[i]}"
 
 def run_command(command: List[str], capture_output: bool = True, timeout: int = 30) -> Tuple[int, str, str]:
     """
@@ -116,12 +220,43 @@ def run_command(command: List[str], capture_output: bool = True, timeout: int =
         logger.error(f"Command failed: {' '.join(command)}, Error: {e}")
         return -1, "", str(e)
 
+def run_command_fast(command: List[str], timeout: int = 10) -> Tuple[int, str, str]:
+    """
+    Run a short read-only command, such as `wg show`, on the posix_spawn path
+    subprocess only uses posix_spawn for an absolute executable with
+    close_fds=False; scripts that need a clean fd table use run_command
+    """
+    executable = shutil.which(command[0])
+    if executable is None:
+        return -1, "", f"Command not found: {command[0]}"
+    
+    try:
+        with subprocess.Popen(
+            [executable, *command[1:]],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            close_fds=False
+        ) as proc:
+            try:
+                stdout, stderr = proc.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.communicate()
+                logger.error(f"Command timed out: {' '.join(command)}")
+                return -1, "", "Command timed out"
+        return proc.returncode, stdout, stderr
+    except Exception as e:
+        logger.error(f"Command failed: {' '.join(command)}, Error: {e}")
+        return -1, "", str(e)
+
+@functools.lru_cache(maxsize=2048)
 def escape_markdown(text: str) -> str:
     """
     Escape special characters for Telegram MarkdownV2
+    Memoized, since the same names and values are escaped on every render
     """
-    escape_chars = r'_*[]()~`>#+-=|{}.!'
-    return ''.join(f'\\{char}' if char in escape_chars else char for char in text)
+    return text.translate(_MD_V2_TABLE)
 
 def format_duration(seconds: int) -> str:
     """
@@ -129,20 +264,19 @@ def format_duration(seconds: int) -> str:
     """
     if seconds < 60:
         return f"{seconds}s"
-    elif seconds < 3600:
-        return f"{seconds // 60}m {seconds % 60}s"
-    elif seconds < 86400:
-        hours = seconds // 3600
-        minutes = (seconds % 3600) // 60
-        return f"{hours}h {minutes}m"
-    else:
-        days = seconds // 86400
-        hours = (seconds % 86400) // 3600
+    days, rem = divmod(seconds, 86400)
+    hours, rem = divmod(rem, 3600)
+    if days:
         return f"{days}d {hours}h"
+    minutes, secs = divmod(rem, 60)
+    if hours:
+        return f"{hours}h {minutes}m"
+    return f"{minutes}m {secs}s"
 
+@ttl_cache(SYSTEM_INFO_CACHE_TTL)
 def get_system_info() -> dict:
     """
-    Get basic system information
+    Get basic system information (briefly cached)
     """
     info = {}
     
@@ -156,14 +290,20 @@ def get_system_info() -> dict:
     
     try:
         # Get memory info
-        with open('/proc/meminfo', 'r') as f:
-            meminfo = f.read()
-            total_match = re.search(r'MemTotal:\s+(\d+)', meminfo)
-            available_match = re.search(r'MemAvailable:\s+(\d+)', meminfo)
+        total_kb = available_kb = None
+        with open('/proc/meminfo', 'rb') as f:
+            # Both keys sit near the top; stop reading once they're found
+            for line in f:
+                if line.startswith(b'MemTotal:'):
+                    total_kb = int(line.split()[1])
+                elif line.startswith(b'MemAvailable:'):
+                    available_kb = int(line.split()[1])
+                else:
+                    continue
+                if total_kb is not None and available_kb is not None:
+                    break
             
-            if total_match and available_match:
-                total_kb = int(total_match.group(1))
-                available_kb = int(available_match.group(1))
+            if total_kb is not None and available_kb is not None:
                 used_kb = total_kb - available_kb
                 
                 info['memory'] = {
@@ -185,31 +325,33 @@ def get_system_info() -> dict:
     
     return info
 
+@ttl_cache(SYSTEM_INFO_CACHE_TTL)
 def check_wireguard_status() -> dict:
     """
-    Check WireGuard service status
+    Check WireGuard service status (briefly cached)
     """
     status = {}
     
     # Check if WireGuard is installed
-    returncode, _, _ = run_command(['which', 'wg'])
-    status['installed'] = returncode == 0
+    status['installed'] = shutil.which('wg') is not None
     
     if not status['installed']:
         return status
     
     # Check if wg0 interface exists
-    returncode, output, _ = run_command(['wg', 'show', 'wg0'])
+    returncode, output, _ = run_command_fast(['wg', 'show', 'wg0'])
     status['interface_exists'] = returncode == 0
     
     if status['interface_exists']:
         status['interface_info'] = output.strip()
     
-    # Check systemd service status
-    returncode, output, _ = run_command(['systemctl', 'is-active', 'wg-quick@wg0'])
-    status['service_active'] = output.strip() == 'active'
-    
-    returncode, output, _ = run_command(['systemctl', 'is-enabled', 'wg-quick@wg0'])
-    status['service_enabled'] = 'enabled' in output
+    # Check systemd service state and enablement with one query
+    returncode, output, _ = run_command(
+        ['systemctl', 'show', '-p', 'ActiveState', '-p', 'UnitFileState', 'wg-quick@wg0']
+    )
+    properties = dict(line.partition('=')[::2] for line in output.splitlines())
+    status['service_active'] = properties.get('ActiveState') == 'active'
+    # Also covers enabled-runtime, as the old is-enabled substring check did
+    status['service_enabled'] = properties.get('UnitFileState', '').startswith('enabled')
     
     return status
@@ -5,16 +5,40 @@ import os
 import re
 import subprocess
 import logging
-from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, FrozenSet, Iterator, List, Optional, Tuple
 from pathlib import Path
 from config import config
 from utils import (
-    get_export_directory, find_config_file, sanitize_client_name,
-    validate_ip_address, run_command, get_system_info, check_wireguard_status
+    get_export_directory, find_config_file, index_config_files, sanitize_client_name,
+    validate_ip_address, run_command, run_command_fast, get_system_info, check_wireguard_status,
+    ttl_cache, advise_sequential
 )
 
+try:
+    import zstandard
+except ImportError:  # Fall back to gzip backups
+    zstandard = None
+
 logger = logging.getLogger(__name__)
 
+# Seconds a server status snapshot is shared between callers
+STATUS_CACHE_TTL = 3
+# Seconds the installed check is trusted; cleared after an install attempt
+INSTALLED_CACHE_TTL = 30
+
+# Write QR images to tmpfs when available to skip disk I/O
+_QR_TMP_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Shared workers for the independent probes in get_server_status
+_STATUS_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="wg-status")
+
+# Backup archive suffix and matching extract command for the available compressor
+BACKUP_SUFFIX = '.tar.zst' if zstandard is not None else '.tar.gz'
+BACKUP_EXTRACT_CMD = 'tar --zstd -xf' if zstandard is not None else 'tar -xzf'
+
+_PEER_NAME_RE = re.compile(r'^# BEGIN_PEER (.+)$', re.MULTILINE)
+
 class WireGuardManager:
     """Manages WireGuard server and client operations"""
     
@@ -22,22 +46,58 @@ class WireGuardManager:
         self.script_path = config.get('wireguard.script_path')
         self.wg_conf = config.get('wireguard.config_path')
         self.export_dir = get_export_directory()
+        # Client name -> last known config file path, see _find_client_config()
+        self._config_paths: Dict[str, str] = {}
+        # Client name -> (config mtime_ns, QR PNG bytes), see get_client_qr()
+        self._qr_cache: Dict[str, Tuple[int, bytes]] = {}
+    
+    def _find_client_config(self, client_name: str) -> Optional[str]:
+        """Find a client's config file, trying its last known location first"""
+        path = self._config_paths.get(client_name)
+        if path is not None and os.path.exists(path):
+            return path
+        path = find_config_file(client_name)
+        if path:
+            self._config_paths[client_name] = path
+        else:
+            self._config_paths.pop(client_name, None)
+        return path
+    
+    def _index_client_configs(self) -> Dict[str, str]:
+        """Scan the config directories once and refresh the known config paths"""
+        index = index_config_files()
+        self._config_paths = {
+            name[:-5]: path for name, path in index.items()
+        }
+        return self._config_paths
     
+    @ttl_cache(INSTALLED_CACHE_TTL)
     def is_installed(self) -> bool:
-        """Check if WireGuard is installed and configured"""
+        """Check if WireGuard is installed and configured (briefly cached)"""
         return os.path.exists(self.wg_conf) and os.path.exists(self.script_path)
     
+    @ttl_cache(STATUS_CACHE_TTL)
     def get_server_status(self) -> Dict:
-        """Get comprehensive server status"""
+        """Get comprehensive server status (briefly cached)"""
+        installed = self.is_installed()
+        
+        # The probes are independent and mostly wait on files and
+        # subprocesses, so run them side by side
+        system_future = _STATUS_POOL.submit(get_system_info)
+        wireguard_future = _STATUS_POOL.submit(check_wireguard_status)
+        if installed:
+            clients_future = _STATUS_POOL.submit(self.list_clients)
+            server_config_future = _STATUS_POOL.submit(self._get_server_config)
+        
         status = {
-            'installed': self.is_installed(),
-            'system': get_system_info(),
-            'wireguard': check_wireguard_status()
+            'installed': installed,
+            'system': system_future.result(),
+            'wireguard': wireguard_future.result()
         }
         
-        if status['installed']:
-            status['clients'] = self.list_clients()
-            status['server_config'] = self._get_server_config()
+        if installed:
+            status['clients'] = clients_future.result()
+            status['server_config'] = server_config_future.result()
         
         return status
     
@@ -49,24 +109,24 @@ class WireGuardManager:
             return config_info
         
         try:
+            # Extract server info and count clients in one pass; the first
+            # occurrence of each setting wins
+            client_count = 0
             with open(self.wg_conf, 'r') as f:
-                content = f.read()
-            
-            # Extract server info
-            endpoint_match = re.search(r'# ENDPOINT (.+)', content)
-            if endpoint_match:
-                config_info['endpoint'] = endpoint_match.group(1)
+                advise_sequential(f)
+                for line in f:
+                    line = line.rstrip('\n')
+                    if line.startswith('# BEGIN_PEER'):
+                        client_count += 1
+                    elif line.startswith('# ENDPOINT '):
+                        config_info.setdefault('endpoint', line[11:])
+                    elif line.startswith('ListenPort = '):
+                        port = line[13:].strip()
+                        if port.isdigit():
+                            config_info.setdefault('port', port)
+                    elif line.startswith('Address = '):
+                        config_info.setdefault('address', line[10:])
             
-            listen_port_match = re.search(r'ListenPort = (\d+)', content)
-            if listen_port_match:
-                config_info['port'] = listen_port_match.group(1)
-            
-            address_match = re.search(r'Address = ([^\n]+)', content)
-            if address_match:
-                config_info['address'] = address_match.group(1)
-            
-            # Count clients
-            client_count = len(re.findall(r'# BEGIN_PEER', content))
             config_info['client_count'] = client_count
             
         except Exception as e:
@@ -74,34 +134,47 @@ class WireGuardManager:
         
         return config_info
     
+    @ttl_cache(STATUS_CACHE_TTL)
+    def client_names(self) -> FrozenSet[str]:
+        """Get the set of configured client names (briefly cached)"""
+        if not os.path.exists(self.wg_conf):
+            return frozenset()
+        
+        try:
+            with open(self.wg_conf, 'r') as f:
+                return frozenset(_PEER_NAME_RE.findall(f.read()))
+        except Exception as e:
+            logger.error(f"Error reading client names: {e}")
+            return frozenset()
+    
+    def _client_exists(self, client_name: str) -> bool:
+        """Check for a peer by name without listing clients or querying wg"""
+        return client_name in self.client_names()
+    
+    @ttl_cache(STATUS_CACHE_TTL)
     def list_clients(self) -> List[Dict]:
-        """List all configured clients"""
+        """List all configured clients (briefly cached)"""
         clients = []
         
         if not os.path.exists(self.wg_conf):
             return clients
         
         try:
-            with open(self.wg_conf, 'r') as f:
-                content = f.read()
+            # One dump for all peers rather than one per peer
+            statuses = self._get_client_statuses()
+            config_paths = self._index_client_configs()
             
-            # Find all client sections
-            client_sections = re.findall(
-                r'# BEGIN_PEER (.+?)\n\[Peer\]\nPublicKey = (.+?)\n.*?AllowedIPs = ([^\n]+)',
-                content,
-                re.DOTALL
-            )
-            
-            for client_name, public_key, allowed_ips in client_sections:
+            for client_name, public_key, allowed_ips in self._iter_peers():
                 client_info = {
                     'name': client_name,
                     'public_key': public_key,
                     'allowed_ips': allowed_ips,
-                    'config_exists': find_config_file(client_name) is not None
+                    'config_exists': client_name in config_paths
                 }
                 
-                # Get connection status if possible
-                client_info['status'] = self._get_client_status(public_key)
+                client_info['status'] = statuses.get(public_key) or {
+                    'connected': False, 'last_handshake': None, 'transfer': None
+                }
                 clients.append(client_info)
         
         except Exception as e:
@@ -109,49 +182,72 @@ class WireGuardManager:
         
         return clients
     
-    def _get_client_status(self, public_key: str) -> Dict:
-        """Get client connection status"""
-        status = {'connected': False, 'last_handshake': None, 'transfer': None}
+    def _iter_peers(self) -> Iterator[Tuple[str, str, str]]:
+        """
+        Stream (name, public_key, allowed_ips) for each named peer in wg0.conf
+        Reads line by line so memory stays flat however many peers there are
+        """
+        name = public_key = None
+        with open(self.wg_conf, 'r') as f:
+            advise_sequential(f)
+            for line in f:
+                line = line.rstrip('\n')
+                if line.startswith('# BEGIN_PEER '):
+                    name, public_key = line[13:], None
+                elif name is None:
+                    continue
+                elif line.startswith('PublicKey = '):
+                    public_key = line[12:]
+                elif line.startswith('AllowedIPs = ') and public_key is not None:
+                    yield name, public_key, line[13:]
+                    name = public_key = None
+    
+    def _get_client_statuses(self) -> Dict[str, Dict]:
+        """
+        Get connection status for every peer from one `wg show` dump
+        Returns: {public_key: status}; peers not in the dump are absent
+        """
+        statuses = {}
         
         try:
-            returncode, output, _ = run_command(['wg', 'show', 'wg0', 'dump'])
+            returncode, output, _ = run_command_fast(['wg', 'show', 'wg0', 'dump'])
             if returncode == 0:
                 for line in output.strip().split('\n')[1:]:  # Skip header
                     parts = line.split('\t')
-                    if len(parts) >= 6 and parts[0] == public_key:
-                        status['connected'] = True
-                        if parts[4] != '0':
-                            status['last_handshake'] = int(parts[4])
-                        if parts[5] != '0' or parts[6] != '0':
-                            status['transfer'] = {
-                                'rx': int(parts[5]),
-                                'tx': int(parts[6])
-                            }
-                        break
+                    if len(parts) < 7:
+                        continue
+                    status = {'connected': True, 'last_handshake': None, 'transfer': None}
+                    if parts[4] != '0':
+                        status['last_handshake'] = int(parts[4])
+                    if parts[5] != '0' or parts[6] != '0':
+                        status['transfer'] = {
+                            'rx': int(parts[5]),
+                            'tx': int(parts[6])
+                        }
+                    statuses[parts[0]] = status
         except Exception as e:
             logger.error(f"Error getting client status: {e}")
         
-        return status
+        return statuses
     
-    def add_client(self, client_name: str, dns_servers: str = "8.8.8.8") -> Tuple[bool, str, Optional[str]]:
+    def add_client(self, client_name: str, dns_servers: str = "8.8.8.8") -> Tuple[bool, str, Optional[str], Optional[bytes]]:
         """
         Add a new WireGuard client
-        Returns: (success, message, config_file_path)
+        Returns: (success, message, config_file_path, config_bytes)
         """
         # Sanitize client name
         sanitized_name = sanitize_client_name(client_name)
         if not sanitized_name:
-            return False, "Invalid client name", None
+            return False, "Invalid client name", None, None
         
         # Check if client already exists
-        clients = self.list_clients()
-        if any(client['name'] == sanitized_name for client in clients):
-            return False, f"Client '{sanitized_name}' already exists", None
+        if self._client_exists(sanitized_name):
+            return False, f"Client '{sanitized_name}' already exists", None, None
         
         # Validate DNS servers
         dns_list = [ip.strip() for ip in dns_servers.split(',')]
         if not all(validate_ip_address(ip) for ip in dns_list):
-            return False, "Invalid DNS server format", None
+            return False, "Invalid DNS server format", None, None
         
         # Run WireGuard script to add client
         try:
@@ -168,18 +264,25 @@ class WireGuardManager:
             
             if returncode != 0:
                 error_msg = stderr or stdout or "Unknown error occurred"
-                return False, f"Failed to create client: {error_msg}", None
+                return False, f"Failed to create client: {error_msg}", None, None
             
             # Find the created config file
-            config_file = find_config_file(sanitized_name)
+            config_file = self._find_client_config(sanitized_name)
             if not config_file:
-                return False, "Client created but config file not found", None
+                return False, "Client created but config file not found", None, None
             
-            return True, f"Client '{sanitized_name}' created successfully", config_file
+            # Hand back the content too so callers don't re-read the file
+            with open(config_file, 'rb') as f:
+                config_bytes = f.read()
+            
+            self.get_server_status.cache_clear()
+            self.client_names.cache_clear()
+            self.list_clients.cache_clear()
+            return True, f"Client '{sanitized_name}' created successfully", config_file, config_bytes
             
         except Exception as e:
             logger.error(f"Error adding client: {e}")
-            return False, f"Error adding client: {str(e)}", None
+            return False, f"Error adding client: {str(e)}", None, None
     
     def remove_client(self, client_name: str) -> Tuple[bool, str]:
         """
@@ -187,8 +290,7 @@ class WireGuardManager:
         Returns: (success, message)
         """
         # Check if client exists
-        clients = self.list_clients()
-        if not any(client['name'] == client_name for client in clients):
+        if not self._client_exists(client_name):
             return False, f"Client '{client_name}' not found"
         
         try:
@@ -205,6 +307,11 @@ class WireGuardManager:
                 error_msg = stderr or stdout or "Unknown error occurred"
                 return False, f"Failed to remove client: {error_msg}"
             
+            self._config_paths.pop(client_name, None)
+            self._qr_cache.pop(client_name, None)
+            self.get_server_status.cache_clear()
+            self.client_names.cache_clear()
+            self.list_clients.cache_clear()
             return True, f"Client '{client_name}' removed successfully"
             
         except Exception as e:
@@ -214,60 +321,38 @@ class WireGuardManager:
     def get_client_qr(self, client_name: str) -> Tuple[bool, str, Optional[str]]:
         """
         Generate QR code image for a client
+        The PNG is reused while the config file's mtime is unchanged
         Returns: (success, message, qr_image_path)
         """
         # Find client config file
-        config_file = find_config_file(client_name)
+        config_file = self._find_client_config(client_name)
         if not config_file:
             return False, f"Config file for '{client_name}' not found", None
         
         try:
-            import qrcode
-            from PIL import Image
             import tempfile
-            import os
-            
-            # Read config content
-            with open(config_file, 'r') as f:
-                config_content = f.read().strip()
-            
-            if not config_content:
-                return False, "Config file is empty", None
-            
-            # Generate QR code with better settings
-            qr = qrcode.QRCode(
-                version=None,  # Auto-determine version
-                error_correction=qrcode.constants.ERROR_CORRECT_M,  # Better error correction
-                box_size=8,    # Smaller box size for better compatibility
-                border=2,      # Smaller border
-            )
-            
-            qr.add_data(config_content)
-            qr.make(fit=True)
-            
-            # Create QR code image with explicit format
-            qr_img = qr.make_image(fill_color="black", back_color="white")
             
-            # Ensure it's a PIL Image
-            if not isinstance(qr_img, Image.Image):
-                qr_img = qr_img.convert('RGB')
+            mtime_ns = os.stat(config_file).st_mtime_ns
+            cached = self._qr_cache.get(client_name)
+            if cached is not None and cached[0] == mtime_ns:
+                png_data = cached[1]
+            else:
+                success, message, png_data = self._render_qr_png(config_file)
+                if not success:
+                    return False, message, None
+                self._qr_cache[client_name] = (mtime_ns, png_data)
             
-            # Create temporary file with proper permissions
-            temp_fd, temp_path = tempfile.mkstemp(suffix='.png', prefix='wirebot_qr_')
+            # Callers delete the file after sending, so each call gets its own copy
+            temp_fd, temp_path = tempfile.mkstemp(suffix='.png', prefix='wirebot_qr_', dir=_QR_TMP_DIR)
             
             try:
                 # Save image to temporary file
                 with os.fdopen(temp_fd, 'wb') as temp_file:
-                    qr_img.save(temp_file, 'PNG', optimize=True)
+                    temp_file.write(png_data)
                 
-                # Verify file was created and has content
-                if os.path.exists(temp_path) and os.path.getsize(temp_path) > 0:
-                    logger.info(f"QR code generated successfully: {temp_path}")
-                    return True, f"QR code for '{client_name}'", temp_path
-                else:
-                    logger.error("QR code file was not created properly")
-                    return False, "Failed to create QR code file", None
-                    
+                logger.info(f"QR code generated successfully: {temp_path}")
+                return True, f"QR code for '{client_name}'", temp_path
+            
             except Exception as save_error:
                 logger.error(f"Error saving QR code image: {save_error}")
                 # Clean up failed file
@@ -276,24 +361,54 @@ class WireGuardManager:
                 except:
                     pass
                 return False, f"Failed to save QR code: {str(save_error)}", None
-            
-        except ImportError as e:
-            logger.error(f"QR code libraries not available: {e}")
-            return False, "QR code generation requires 'qrcode' and 'pillow' packages", None
+        
         except Exception as e:
             logger.error(f"Error generating QR code: {e}")
             return False, f"QR code generation failed: {str(e)}", None
     
+    def _render_qr_png(self, config_file: str) -> Tuple[bool, str, Optional[bytes]]:
+        """
+        Render a config file as a QR code PNG
+        Returns: (success, message, png_bytes)
+        """
+        import io
+        try:
+            import segno
+        except ImportError as e:
+            logger.error(f"QR code library not available: {e}")
+            return False, "QR code generation requires the 'segno' package", None
+        
+        # Read config content
+        with open(config_file, 'r') as f:
+            config_content = f.read().strip()
+        
+        if not config_content:
+            return False, "Config file is empty", None
+        
+        # segno writes the PNG itself, without Pillow
+        buffer = io.BytesIO()
+        segno.make(config_content, error='m', micro=False).save(
+            buffer, kind='png', scale=8, border=2
+        )
+        
+        png_data = buffer.getvalue()
+        if not png_data:
+            logger.error("QR code image was not created properly")
+            return False, "Failed to create QR code file", None
+        return True, "", png_data
+    
     def get_client_config(self, client_name: str) -> Tuple[bool, str, Optional[str]]:
         """
         Get client configuration content
         Returns: (success, message, config_content)
         """
-        config_file = find_config_file(client_name)
+        config_file = self._find_client_config(client_name)
         if not config_file:
             return False, f"Config file for '{client_name}' not found", None
         
         try:
+            # Read directly: client configs hold private keys, so they are
+            # not kept in the process-wide file cache
             with open(config_file, 'r') as f:
                 config_content = f.read()
             return True, f"Configuration for '{client_name}'", config_content
@@ -301,36 +416,54 @@ class WireGuardManager:
             logger.error(f"Error reading config file: {e}")
             return False, f"Error reading config: {str(e)}", None
     
-    def backup_configs(self) -> Tuple[bool, str, Optional[str]]:
+    def _add_backup_files(self, tar) -> None:
+        """Add the server and client configs to an open tar archive"""
+        # Add server config
+        if os.path.exists(self.wg_conf):
+            tar.add(self.wg_conf, arcname="wg0.conf")
+        
+        # Add client configs
+        clients = self.list_clients()
+        config_paths = self._index_client_configs()
+        for client in clients:
+            config_file = config_paths.get(client['name'])
+            if config_file:
+                tar.add(config_file, arcname=f"clients/{client['name']}.conf")
+    
+    def _write_backup(self, fileobj) -> None:
+        """Write a compressed backup archive to fileobj, leaving it open"""
+        import tarfile
+        
+        if zstandard is not None:
+            # Multi-threaded zstd streaming; the tar stream needs no seeking
+            compressor = zstandard.ZstdCompressor(level=3, threads=-1)
+            with compressor.stream_writer(fileobj, closefd=False) as writer:
+                with tarfile.open(fileobj=writer, mode="w|") as tar:
+                    self._add_backup_files(tar)
+        else:
+            with tarfile.open(fileobj=fileobj, mode="w:gz") as tar:
+                self._add_backup_files(tar)
+    
+    def backup_configs_bytes(self) -> Tuple[bool, str, Optional[str], Optional[bytes]]:
         """
-        Create backup of all configurations
-        Returns: (success, message, backup_file_path)
+        Create backup of all configurations in memory, without touching disk
+        Returns: (success, message, backup_filename, backup_bytes)
         """
         try:
-            import tarfile
+            import io
             import datetime
             
             timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_filename = f"wireguard_backup_{timestamp}.tar.gz"
-            backup_path = os.path.join(self.export_dir, backup_filename)
+            backup_filename = f"wireguard_backup_{timestamp}{BACKUP_SUFFIX}"
             
-            with tarfile.open(backup_path, "w:gz") as tar:
-                # Add server config
-                if os.path.exists(self.wg_conf):
-                    tar.add(self.wg_conf, arcname="wg0.conf")
-                
-                # Add client configs
-                clients = self.list_clients()
-                for client in clients:
-                    config_file = find_config_file(client['name'])
-                    if config_file:
-                        tar.add(config_file, arcname=f"clients/{client['name']}.conf")
+            buffer = io.BytesIO()
+            self._write_backup(buffer)
             
-            return True, f"Backup created: {backup_filename}", backup_path
+            return True, f"Backup created: {backup_filename}", backup_filename, buffer.getvalue()
             
         except Exception as e:
             logger.error(f"Error creating backup: {e}")
-            return False, f"Error creating backup: {str(e)}", None
+            return False, f"Error creating backup: {str(e)}", None, None
     
     def install_wireguard(self) -> Tuple[bool, str]:
         """
@@ -343,6 +476,10 @@ class WireGuardManager:
         try:
             command = ['sudo', 'bash', self.script_path, '--auto']
             returncode, stdout, stderr = run_command(command, timeout=300)  # 5 minutes timeout
+            # The script may have written files even on failure
+            self.is_installed.cache_clear()
+            self.get_server_status.cache_clear()
+            check_wireguard_status.cache_clear()
             
             if returncode != 0:
                 error_msg = stderr or stdout or "Unknown error occurred"
@@ -366,12 +503,15 @@ class WireGuardManager:
         clients = self.list_clients()
         stats['total_clients'] = len(clients)
         
-        for client in clients:
-            if client['status']['connected']:
-                stats['connected_clients'] += 1
-                if client['status']['transfer']:
-                    stats['total_transfer']['rx'] += client['status']['transfer']['rx']
-                    stats['total_transfer']['tx'] += client['status']['transfer']['tx']
+        # Pull the nested status fields out once, then reduce over flat columns
+        statuses = [client['status'] for client in clients]
+        connected = [status['connected'] for status in statuses]
+        transfers = [status['transfer'] for status, is_connected in zip(statuses, connected)
+                     if is_connected and status['transfer']]
+        
+        stats['connected_clients'] = sum(connected)
+        stats['total_transfer']['rx'] = sum(transfer['rx'] for transfer in transfers)
+        stats['total_transfer']['tx'] = sum(transfer['tx'] for transfer in transfers)
         
         stats['clients'] = clients
         return stats